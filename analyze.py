@@ -1,13 +1,29 @@
 import os
+import sys
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 import numpy as np
-from elliott_wave_theory import block_sampling, run
+from elliott_wave_theory import block_sampling, chart_filename, convert_UNIX_to_datetime, detect, load_file, save_outputs
+from charts import ChartRenderer
+from background_io import BackgroundWriter, prefetch
+from cache import StageCache, cache_path, open_frame
+from profiling import Profiler
 from scipy.stats import t
 
+def read_result(filepath):
+    # Result of one run: the path of a '_result.csv' or '_result.parquet' file, or the result DataFrame itself
+    if isinstance(filepath, pd.DataFrame):
+        return filepath
+    if str(filepath).endswith('.parquet'):
+        return pd.read_parquet(filepath)
+    return pd.read_csv(filepath)
+
 def extract_sample_data(filepath):
-    # Extracts sample data from a CSV file.
-    df = pd.read_csv(filepath)
+    # Extracts sample data from a result CSV file or DataFrame.
+    df = read_result(filepath)
     differences = df['wave3_max - wave1_max'].tolist()
     differences = list(map(lambda x: round(float(x), 4), differences))
     wave3_max = df['high2'].tolist()
@@ -47,44 +63,91 @@ def print_analysis_results(results):
     else:
         print(f"p-value of {p_value} is greater than the standard significance level of 0.05, so it fails to reject the null hypothesis.")
 
+def block_statistics(block_results):
+    # Per-block sums of the run results (see run_block), all the resampling engine needs from the detector.
+    # One row per block: [waves, sum of differences, sum of squared differences, success waves, failure waves]
+    statistics = np.zeros((len(block_results), 5))
+    for i, (success_waves, failure_waves, result_df) in enumerate(block_results):
+        differences = np.round(read_result(result_df)['wave3_max - wave1_max'].to_numpy(dtype=float), 4)
+        statistics[i] = [len(differences), differences.sum(), np.square(differences).sum(), len(success_waves), len(failure_waves)]
+    return statistics
+
+def stratified_bootstrap(statistics, strata, samples_per_stratum, resamples=10000, seed=None):
+    # Draws all 'resamples' stratified block bootstraps at once: 'samples_per_stratum' blocks with replacement
+    # from every stratum ('strata' are lists of rows of 'statistics'), the way block_sampling draws one sample without replacement.
+    # Returns the summed block statistics of every resample, shape (resamples, 5)
+    rng = np.random.default_rng(seed)
+    draws = [np.asarray(stratum)[rng.integers(len(stratum), size=(resamples, samples_per_stratum))] for stratum in strata if len(stratum) > 0]
+    return statistics[np.concatenate(draws, axis=1)].sum(axis=1)
+
+def sign_flip_permutation(statistics, sampled, resamples=10000, seed=None):
+    # Mean differences of the sampled blocks with the sign of each block's differences flipped at random.
+    # Blocks are flipped as a whole, so the dependence between waves of one block is kept under the null hypothesis (mean 0).
+    rng = np.random.default_rng(seed)
+    signs = rng.choice(np.array([-1.0, 1.0]), size=(resamples, len(sampled)))
+    return signs @ statistics[sampled, 1] / statistics[sampled, 0].sum()
+
+def resample_analysis(statistics, sampled, strata, samples_per_stratum, resamples=10000, confidence=0.95, seed=None):
+    # Significance of the mean difference (max(wave3) - max(wave1)) from the distribution of thousands of block samples
+    # instead of the single draw of block_sampling. 'sampled' are the rows of the blocks that were actually drawn.
+    # The detector is never rerun: every resample is a gather and a sum over the per-block statistics.
+    rng = np.random.default_rng(seed)
+    totals = stratified_bootstrap(statistics, strata, samples_per_stratum, resamples, rng)
+    valid = totals[:, 0] > 0
+    means = totals[valid, 1] / totals[valid, 0]
+    success_ratios = totals[:, 3] / np.maximum(totals[:, 3] + totals[:, 4], 1)
+    observed = statistics[sampled].sum(axis=0)
+    observed_mean = observed[1] / observed[0] if observed[0] > 0 else 0
+    permuted_means = sign_flip_permutation(statistics, sampled, resamples, rng) if observed[0] > 0 else np.zeros(resamples)
+    tails = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+
+    return {
+        "Resamples": resamples,
+        "Bootstrap Mean": np.mean(means),
+        "Bootstrap Standard Error": np.std(means, ddof=1),
+        f"Bootstrap {confidence:.0%} Confidence Interval": tuple(float(value) for value in np.percentile(means, tails)),
+        "Bootstrap p-value": np.mean(means <= 0),  # one-tailed, share of resamples with no positive mean
+        f"Success Ratio {confidence:.0%} Confidence Interval": tuple(float(value) for value in np.percentile(success_ratios, tails)),
+        "Observed Mean": observed_mean,
+        "Permutation p-value": (np.sum(permuted_means >= observed_mean) + 1) / (resamples + 1),  # one-tailed
+    }
+
+def print_resample_results(results):
+    # Prints the resampling results.
+    print("\nResampling")
+    for key, value in results.items():
+        print(f"{key}: {value}")
+
 def save_histogram(samples, filename, bins=50, title='Mean of Differences (max(wave3) - max(wave1))', xlabel='Differences (max(wave3) - max(wave1))', ylabel='Frequency', grid=True, figsize=(10, 6)):
     # Create a histogram and save it
-    plt.figure(figsize=figsize)
-    plt.hist(samples, bins)
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.grid(grid)
-    # plt.show()
-    plt.savefig(filename)
+    # Drawn on a standalone Figure rather than through pyplot, so it can be saved from a background_io.BackgroundWriter
+    figure = Figure(figsize=figsize)
+    axes = figure.subplots()
+    axes.hist(samples, bins)
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    axes.grid(grid)
+    figure.savefig(filename)
 
 def save_boxplot(data, filename, labels=['Wave1 Max', 'Wave3 Max'], title='Box Plot of Wave1 Max and Wave3 Max', ylabel='Values', figsize=(10, 6)):
-    # Create a box plot graph of the provided data
-    plt.figure(figsize=figsize)
-    plt.boxplot(data, labels=labels)
-    plt.title(title)
-    plt.ylabel(ylabel)
-    plt.grid(True)
-    # plt.show()
-    plt.savefig(filename)
+    # Create a box plot graph of the provided data, on a standalone Figure like save_histogram
+    figure = Figure(figsize=figsize)
+    axes = figure.subplots()
+    axes.boxplot(data)
+    axes.set_xticks(range(1, len(labels) + 1), labels)
+    axes.set_title(title)
+    axes.set_ylabel(ylabel)
+    axes.grid(True)
+    figure.savefig(filename)
 
 def prepare_strategy_1_data(filepath):
     # Success: Selling at wave3's Fibonacci retracement level after high2 exceeds high1
     # Failure: Selling at low1 if high2 is less than or equal to high1.
     # Returns a tuple containing success and failure values.
-    df = pd.read_csv(filepath)
-    success_value, failure_value = [], []
-    for i, row in df.iterrows():
-        low1 = row['low1']
-        high1 = row['high1']
-        high2 = row['high2']
-        profit = row['s1_profit']
-        loss = row['s1_loss']
-        if high2 > high1:
-            success_value.append(profit)
-        else:
-            failure_value.append(loss)
-    return success_value, failure_value
+    df = read_result(filepath)
+    success = df['high2'] > df['high1']
+    return df.loc[success, 's1_profit'].tolist(), df.loc[~success, 's1_loss'].tolist()
 
 def print_strategy_1_result(success_value, failure_value):
     # Print strategy 1's result
@@ -98,16 +161,85 @@ def print_strategy_1_result(success_value, failure_value):
     print(f"P(Failure): {1 - probability_success} / Average Failure loss: {average_failure_value}")
     print(f"Overall Expected Value: {expected_value}\n")
 
+def init_worker():
+    # Worker processes only save figures, they never show them
+    matplotlib.use('Agg')
+
+def open_block(block):
+    # A block is either a DataFrame, or (cache path, start row, end row) of a cached frame that is memory mapped here
+    if isinstance(block, tuple):
+        path, start_row, end_row = block
+        return open_frame(path).iloc[start_row:end_row]
+    return block
+
+def prepare_block(block):
+    # A block opened (see open_block) and converted the way detect() does it, detect() then uses it as it is
+    return convert_UNIX_to_datetime(open_block(block).copy(deep=False))
+
+def run_block(splitted_filename, block, retracement_ratio, high2_retracement_ratio, reset_threshold, output_folder, outputs=('result', 'processed', 'chart'), block_cache_path=None, profile=False, chart_windows=False, chart_renderer=None, memo=None, writer=None):
+    # Runs one block (or the whole file) in memory, optionally writing the artifacts selected by 'outputs'.
+    # In a worker process the block is shipped with the task (or opened from the cache) instead of being read from a CSV.
+    # 'block_cache_path' is only given for a whole cached file, so its local minima and local lows are cached too.
+    # With 'profile', the block's per-stage report is written to {output_folder}/{block base_name}_profile.json
+    # 'chart_windows', 'chart_renderer' and 'writer' are passed to save_outputs(), 'memo' (a cache.StageCache) to detect()
+    # Returns the success waves, the failure waves and the result DataFrame.
+    base_name = splitted_filename.split('.')[0]
+    profiler = Profiler(base_name, enabled=profile)
+    with profiler.stage('open_block'):
+        block = open_block(block)
+    df, local_lows, local_highs, success_waves, failure_waves = detect(block, retracement_ratio, high2_retracement_ratio, reset_threshold, block_cache_path, profiler, memo)
+    result_df = save_outputs(splitted_filename, output_folder, df, local_lows, local_highs, success_waves, failure_waves, outputs, profiler, chart_windows, chart_renderer, writer)
+    if profile:
+        profiler.save(os.path.join(output_folder, f"{base_name}_profile.json"))
+    return success_waves, failure_waves, result_df
+
 def process_data(filename, 
                  conduct_block_sampling=False, 
                  number_of_splits=30, 
                  retracement_ratio=0.618,
                  high2_retracement_ratio=0.382, 
                  reset_threshold=100000, 
-                 output_folder="hypothesis_test"):
+                 output_folder="hypothesis_test",
+                 workers=None,
+                 outputs=('blocks', 'result', 'processed', 'chart'),
+                 cache_folder=None,
+                 profile=False,
+                 chart_workers=None,
+                 chart_windows=False,
+                 resamples=None,
+                 resample_seed=None,
+                 memo_folder=None,
+                 memo_max_mb=1024,
+                 background_io=False,
+                 io_queue_size=8):
     # Processes the data by conducting block sampling and analyzing the results.
+    # The file is loaded once, blocks are slices of it and every run's results come back as DataFrames.
+    # 'outputs' selects the files written along the way, pass () to run purely in memory:
+    #   'blocks' : {base_name}_{n}_splitted.csv for every block
+    #   'result', 'processed', 'chart' : the per run files written by elliott_wave_theory.save_outputs()
+    # With 'workers' > 1, sampled blocks are run in a pool of that many processes.
+    # Each block's results are still aggregated in sampling order, so the results match a serial run.
+    # With 'cache_folder', the file is opened from the binary cache (see elliott_wave_theory.load_file),
+    # and workers memory map their block from it instead of receiving a pickled copy.
+    # With 'profile', every run (each block, or the whole file) writes a per-stage JSON report next to its outputs,
+    # and process_data's own stages go to {output_folder}/{base_name}_process_data_profile.json
+    # With 'chart_workers', charts are rendered by that many background processes while the results are analyzed,
+    # and process_data waits for them at the end. With 'chart_windows', only the windows around each wave are drawn.
+    # With 'resamples' (block sampling only), every block is run once and that many stratified block bootstraps
+    # and sign flip permutations are analyzed on top of the sampled blocks (see resample_analysis).
+    # Blocks that were not sampled are run in memory only.
+    # With 'memo_folder', the detection stages of every run are memoized there (see cache.StageCache), up to 'memo_max_mb'.
+    # A rerun on the same data recomputes only the stages whose parameters changed, e.g. search_high2 for high2_retracement_ratio.
+    # With 'background_io', result files, processed files and figures are written by a background thread
+    # (see background_io.BackgroundWriter) holding at most 'io_queue_size' pending writes, and serial block runs
+    # prepare the next block while the current one is detected. process_data returns once every write is flushed.
     os.makedirs(output_folder, exist_ok=True)
     base_name = filename.split('.')[0]
+    profiler = Profiler(f"{base_name}_process_data", enabled=profile)
+    chart_renderer = ChartRenderer(chart_workers) if chart_workers and 'chart' in outputs else None
+    memo = StageCache(memo_folder, memo_max_mb) if memo_folder is not None else None
+    writer = BackgroundWriter(io_queue_size) if background_io else None
+    write = writer.submit if writer is not None else lambda function, *args: function(*args)
     total_success_waves = 0
     total_failure_waves = 0
 
@@ -115,8 +247,12 @@ def process_data(filename,
     if conduct_block_sampling:
         
         # Hypothesis testing
-        file_numbers = block_sampling(filename, number_of_splits)
+        with profiler.stage('block_sampling', number_of_splits=number_of_splits):
+            file_numbers, blocks, strata = block_sampling(filename, number_of_splits, return_blocks=True, save_blocks='blocks' in outputs, cache_folder=cache_folder, return_strata=True)
         print(f"Sample Blocks to Run: {file_numbers}")
+        if workers is not None and workers > 1 and cache_folder is not None:
+            path = cache_path(filename, cache_folder)
+            blocks = [(path, block.index[0], block.index[-1] + 1) for block in blocks]
         combined_diff = []
         combined_wave1_max = []
         combined_wave3_max = []
@@ -125,11 +261,38 @@ def process_data(filename,
         combined_success_value = []
         combined_failure_value = []
 
-        for n in file_numbers:
-            splitted_filename = f"{base_name}_{n}_splitted.csv"
-            success_waves, failure_waves = run(splitted_filename, retracement_ratio, high2_retracement_ratio, reset_threshold, folder=output_folder)
-            sample_filepath = f"{output_folder}/{base_name}_{n}_splitted_result.csv"
-            diff, wave1_max, wave3_max = extract_sample_data(sample_filepath)
+        # Block workers cannot share the chart renderer, their charts are queued here as each block returns
+        parallel = workers is not None and workers > 1
+        block_outputs = tuple(output for output in outputs if output != 'chart') if parallel and chart_renderer is not None else outputs
+        block_args = [
+            (f"{base_name}_{n}_splitted.csv", blocks[n-1], retracement_ratio, high2_retracement_ratio, reset_threshold, output_folder, block_outputs, None, profile, chart_windows)
+            for n in file_numbers
+        ]
+        other_numbers = [n for n in range(1, len(blocks) + 1) if n not in file_numbers] if resamples else []
+        # Every tuple has the same length, executor.map below zips them by position and stops at the shortest
+        block_args += [
+            (f"{base_name}_{n}_splitted.csv", blocks[n-1], retracement_ratio, high2_retracement_ratio, reset_threshold, output_folder, (), None, False, False)
+            for n in other_numbers
+        ]
+        with profiler.stage('run_blocks', blocks=len(block_args), workers=workers or 1):
+            if parallel:
+                block_results = []
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                    for args, (success_waves, failure_waves, result_df) in zip(block_args, executor.map(partial(run_block, memo=memo), *zip(*block_args))):
+                        block_results.append((success_waves, failure_waves, result_df))
+                        if chart_renderer is not None and len(block_results) <= len(file_numbers):
+                            chart_df = prepare_block(args[1])
+                            chart_renderer.submit(chart_df, chart_filename(args[0], output_folder, chart_windows), success_waves, failure_waves, chart_windows)
+            else:
+                # With a writer, blocks are prepared one ahead (see prepare_block), the previous block's files are written meanwhile
+                blocks_ahead = prefetch(prepare_block, [args[1] for args in block_args]) if writer is not None else (args[1] for args in block_args)
+                block_results = [
+                    run_block(args[0], block, *args[2:], chart_renderer=chart_renderer, memo=memo, writer=writer)
+                    for args, block in zip(block_args, blocks_ahead)
+                ]
+
+        for success_waves, failure_waves, result_df in block_results[:len(file_numbers)]:
+            diff, wave1_max, wave3_max = extract_sample_data(result_df)
             combined_diff.extend(diff)
             combined_wave1_max.extend(wave1_max)
             combined_wave3_max.extend(wave3_max)
@@ -137,40 +300,154 @@ def process_data(filename,
             total_failure_waves += len(failure_waves)
 
             # Aggregate individual data from each sample for strategy 1 test
-            success_value, failure_value = prepare_strategy_1_data(sample_filepath)
+            success_value, failure_value = prepare_strategy_1_data(result_df)
             combined_success_value.extend(success_value)
             combined_failure_value.extend(failure_value)
 
-        diff_analysis = analyze_samples(combined_diff)
-        diff_analysis['Success Ratio'] = total_success_waves / (total_success_waves + total_failure_waves) if (total_success_waves + total_failure_waves) > 0 else 0
-        print_analysis_results(diff_analysis)
-        save_histogram(combined_diff, os.path.join(output_folder, 'Mean_of_Differences_Histogram.jpg'))
-        save_boxplot([combined_wave1_max, combined_wave3_max], os.path.join(output_folder, 'Wave1_Max_and_Wave3_Max_Boxplot.jpg'))
-        
-        # Strategy 1
-        print_strategy_1_result(combined_success_value, combined_failure_value)
+        with profiler.stage('analysis', waves=len(combined_diff)):
+            diff_analysis = analyze_samples(combined_diff)
+            diff_analysis['Success Ratio'] = total_success_waves / (total_success_waves + total_failure_waves) if (total_success_waves + total_failure_waves) > 0 else 0
+            print_analysis_results(diff_analysis)
+            write(save_histogram, combined_diff, os.path.join(output_folder, 'Mean_of_Differences_Histogram.jpg'))
+            write(save_boxplot, [combined_wave1_max, combined_wave3_max], os.path.join(output_folder, 'Wave1_Max_and_Wave3_Max_Boxplot.jpg'))
+            
+            # Strategy 1
+            print_strategy_1_result(combined_success_value, combined_failure_value)
+
+        if resamples:
+            with profiler.stage('resampling', resamples=resamples, blocks=len(block_results)):
+                # Rows of the statistics array are ordered like block_results: the sampled blocks, then the others
+                row = {n: i for i, n in enumerate(file_numbers + other_numbers)}
+                statistics = block_statistics(block_results)
+                resample_results = resample_analysis(
+                    statistics,
+                    [row[n] for n in file_numbers],
+                    [[row[n] for n in stratum] for stratum in strata],
+                    len(file_numbers) // 3,
+                    resamples,
+                    seed=resample_seed
+                )
+                print_resample_results(resample_results)
     else:
         # Hypothesis testing
-        success_waves, failure_waves = run(filename, retracement_ratio, high2_retracement_ratio, reset_threshold, folder=output_folder)
-        sample_filepath = f"{output_folder}/{base_name}_result.csv"
-        diff, wave1_max, wave3_max = extract_sample_data(sample_filepath)
-        diff_analysis = analyze_samples(diff)
-        diff_analysis['Success Ratio'] = len(success_waves) / (len(success_waves) + len(failure_waves)) if (len(success_waves) + len(failure_waves)) > 0 else 0
-        print_analysis_results(diff_analysis)
-        save_histogram(diff, os.path.join(output_folder, 'Mean_of_Differences_Histogram.jpg'))
-        save_boxplot([wave1_max, wave3_max], os.path.join(output_folder, 'Wave1_Max_and_Wave3_Max_Boxplot.jpg'))
-        
-        # Strategy 1
-        success_value, failure_value = prepare_strategy_1_data(sample_filepath)
-        print_strategy_1_result(success_value, failure_value)
-
-filename = "btc_historical.csv"
-process_data(
-    filename,
-    conduct_block_sampling=True,
-    number_of_splits=40,
-    retracement_ratio=0.618,
-    high2_retracement_ratio=0.382,
-    reset_threshold=1000000,
-    output_folder="hypothesis_test"
-)
\ No newline at end of file
+        path = cache_path(filename, cache_folder) if cache_folder is not None else None
+        with profiler.stage('load_file') as stage:
+            df = load_file(filename, cache_folder)
+            stage['rows'] = len(df)
+        success_waves, failure_waves, result_df = run_block(filename, df, retracement_ratio, high2_retracement_ratio, reset_threshold, output_folder, outputs, path, profile, chart_windows, chart_renderer, memo, writer)
+        success_count, failure_count = len(success_waves), len(failure_waves)
+        with profiler.stage('analysis', waves=len(result_df)):
+            diff, wave1_max, wave3_max = extract_sample_data(result_df)
+            diff_analysis = analyze_samples(diff)
+            diff_analysis['Success Ratio'] = success_count / (success_count + failure_count) if (success_count + failure_count) > 0 else 0
+            print_analysis_results(diff_analysis)
+            write(save_histogram, diff, os.path.join(output_folder, 'Mean_of_Differences_Histogram.jpg'))
+            write(save_boxplot, [wave1_max, wave3_max], os.path.join(output_folder, 'Wave1_Max_and_Wave3_Max_Boxplot.jpg'))
+            
+            # Strategy 1
+            success_value, failure_value = prepare_strategy_1_data(result_df)
+            print_strategy_1_result(success_value, failure_value)
+
+    if chart_renderer is not None:
+        with profiler.stage('wait_for_charts'):
+            chart_renderer.close()
+    if writer is not None:
+        with profiler.stage('flush_writes'):
+            writer.close()
+    if profile:
+        profiler.save(os.path.join(output_folder, f"{base_name}_process_data_profile.json"))
+
+def walk_forward_windows(rows, window, step, warm_up=0):
+    # (start, end) rows of every evaluation window: 'window' rows long, one every 'step' rows, after 'warm_up' rows.
+    # Windows may overlap (step < window). The warm-up rows are detected too, they only prime the local lows stack.
+    if window <= 0 or step <= 0:
+        raise ValueError(f"window and step must be positive, got window={window}, step={step}")
+    starts = np.arange(warm_up, rows - window + 1, step, dtype=np.int64)
+    return starts, starts + window
+
+def window_statistics(df, waves, success, window_start, window_end):
+    # Statistics of the waves whose low2 falls in each window [start, end), from prefix sums over the waves sorted by low2,
+    # so the cost is two binary searches per window however much the windows overlap.
+    # 'success' marks the success waves of 'waves'.
+    order = np.argsort(waves['low2_index'], kind='stable')
+    waves, success = waves[order], success[order]
+    diff = np.round(waves['high2_price'] - waves['high1_price'], 4)
+    s1_entry = df['open'].to_numpy(dtype=float)[waves['low2_index'] + 2]
+    s1_value = np.where(waves['high2_price'] > waves['high1_price'], waves['retracement_price'], waves['low1_price']) - s1_entry
+
+    def window_sums(values):
+        prefix = np.r_[0, np.cumsum(values, dtype=float)]
+        return prefix[last] - prefix[first]
+
+    first = np.searchsorted(waves['low2_index'], window_start, side='left')
+    last = np.searchsorted(waves['low2_index'], window_end, side='left')
+    n = (last - first).astype(float)
+    success_waves = window_sums(success)
+    dates = df['date'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_difference = window_sums(diff) / n
+        std_difference = np.sqrt((window_sums(diff ** 2) - n * mean_difference ** 2) / (n - 1))
+        t_statistic = mean_difference / (std_difference / np.sqrt(n))
+        return pd.DataFrame({
+            'window_start': window_start,
+            'window_end': window_end,
+            'start_date': dates[window_start],
+            'end_date': dates[window_end - 1],
+            'waves': n.astype(np.int64),
+            'success_waves': success_waves.astype(np.int64),
+            'failure_waves': (n - success_waves).astype(np.int64),
+            'success_ratio': np.where(n > 0, success_waves / n, 0),
+            'mean_difference': mean_difference,
+            'std_difference': std_difference,
+            't_statistic': t_statistic,
+            'p_value': t.sf(t_statistic, df=n - 1),
+            's1_expected_value': window_sums(s1_value) / n,
+        })
+
+def walk_forward(filename,
+                 window,
+                 step,
+                 warm_up=0,
+                 retracement_ratio=0.618,
+                 high2_retracement_ratio=0.382,
+                 reset_threshold=100000,
+                 output_folder="hypothesis_test",
+                 cache_folder=None):
+    # Walk-forward evaluation: the detector runs once over the whole file, and every resolved wave is assigned
+    # to the windows (see walk_forward_windows) containing its low2. Unlike block sampling, waves crossing a window
+    # boundary are kept and no window starts from an empty local lows stack.
+    # Writes {output_folder}/{base_name}_walk_forward.csv and returns it as a DataFrame, one row per window.
+    os.makedirs(output_folder, exist_ok=True)
+    base_name = filename.split('.')[0]
+    df = load_file(filename, cache_folder)
+    path = cache_path(filename, cache_folder) if cache_folder is not None else None
+    df, local_lows, local_highs, success_waves, failure_waves = detect(df, retracement_ratio, high2_retracement_ratio, reset_threshold, path)
+    window_start, window_end = walk_forward_windows(len(df), window, step, warm_up)
+    waves = np.concatenate([success_waves, failure_waves])
+    success = np.r_[np.ones(len(success_waves), dtype=bool), np.zeros(len(failure_waves), dtype=bool)]
+    windows = window_statistics(df, waves, success, window_start, window_end)
+    windows.to_csv(os.path.join(output_folder, f"{os.path.basename(base_name)}_walk_forward.csv"), index=False)
+
+    evaluated = windows[windows['waves'] > 1]
+    print(f"\nWalk-forward: {len(windows)} windows of {window} rows every {step} rows after {warm_up} warm-up rows")
+    print(f"Windows with at least two waves: {len(evaluated)}")
+    if len(evaluated):
+        print(f"Windows with a positive mean difference: {(evaluated['mean_difference'] > 0).mean():.2%}")
+        print(f"Windows rejecting the null hypothesis (p < 0.05): {(evaluated['p_value'] < 0.05).mean():.2%}")
+        print(f"Median success ratio: {evaluated['success_ratio'].median()}")
+        print(f"Median Strategy 1 expected value: {evaluated['s1_expected_value'].median()}")
+    return windows
+
+if __name__ == "__main__":
+    # python analyze.py --profile writes per-stage JSON reports to the output folder
+    filename = "btc_historical.csv"
+    process_data(
+        filename,
+        conduct_block_sampling=True,
+        number_of_splits=40,
+        retracement_ratio=0.618,
+        high2_retracement_ratio=0.382,
+        reset_threshold=1000000,
+        output_folder="hypothesis_test",
+        profile="--profile" in sys.argv
+    )
\ No newline at end of file
@@ -0,0 +1,87 @@
+import atexit
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Background I/O for runs that alternate detection and file writes (see analyze.process_data).
+#
+#   with BackgroundWriter(max_pending=8) as writer:
+#       save_outputs(filename, folder, ..., writer=writer)      # returns once the writes are queued
+#       writer.submit(save_histogram, diff, 'histogram.jpg')
+#   # leaving the block waits for every queued write
+#
+#   for block in prefetch(prepare_block, blocks):              # the next block is prepared while this one is used
+#       ...
+#
+# Writes run in order on one thread, pandas and NumPy release the GIL for most of it, so detection goes on meanwhile.
+# At most 'max_pending' writes wait in the queue: submit() blocks when it is full, so a fast producer
+# cannot pile up every block's frames in memory. Writes still queued when the interpreter exits are flushed first.
+# Only functions that are safe off the main thread belong here, e.g. not pyplot (mplfinance charts go to charts.ChartRenderer).
+
+class BackgroundWriter:
+    def __init__(self, max_pending=8):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.work, name='BackgroundWriter', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            function, args, kwargs = task
+            # After a failed write the queue is still drained, so producers blocked in submit() are released
+            if self.error is None:
+                try:
+                    function(*args, **kwargs)
+                except BaseException as error:
+                    self.error = error
+
+    def submit(self, function, *args, **kwargs):
+        # Queues function(*args, **kwargs), waiting while 'max_pending' writes are queued.
+        # The arguments must not be modified afterwards. A previous write's error is raised here.
+        if self.closed:
+            raise RuntimeError("BackgroundWriter is closed")
+        self.raise_error()
+        self.queue.put((function, args, kwargs))
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        # Waits for every queued write, a failed write raises its error here
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            atexit.unregister(self.close)
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # The queued writes are still flushed, the run's own error wins over theirs
+            try:
+                self.close()
+            except Exception:
+                pass
+
+def prefetch(function, items, depth=1):
+    # Yields function(item) for every item in order, computing up to 'depth' items ahead on a background thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ahead = []
+        for item in items:
+            ahead.append(executor.submit(function, item))
+            if len(ahead) > depth:
+                yield ahead.pop(0).result()
+        for future in ahead:
+            yield future.result()
@@ -0,0 +1,142 @@
+import itertools
+import numpy as np
+import pandas as pd
+from elliott_wave_theory import RangeMax
+
+# Columnar backtests of trading rules over detected waves (the WAVE_DTYPE records returned by
+# search_high2() / save_combined_waves_df()). Every rule variant is evaluated over all waves at once.
+#
+#   df, local_lows, local_highs, success_waves, failure_waves = detect(load_file(filename))
+#   waves = np.concatenate([success_waves, failure_waves])
+#   summary, equity = backtest(df, waves, rule_variants(entry_offsets=range(5), target_levels=[None, 0.382, 0.236], stop_ratios=[None, 0.786]))
+#
+# A rule buys at the open of low2_index + 2 + entry_offset and sells at the first of:
+#   target : if the high reaches it before the wave's exit row, at the lower of
+#              low2 + (high1 - low1) * target_ratio    a Fibonacci extension of wave 1 from low2
+#              high1 - (high1 - low1) * target_level   a Fibonacci retracement level of wave 1 (0 is high1 itself)
+#            (None for neither)
+#   stop   : high1 - (high1 - low1) * stop_ratio, if the low reaches it up to the wave's exit row (1 is low1, None for no stop).
+#            The waves are only followed up to their exit row, so a stop below low1 never triggers.
+#   exit   : low1 for waves whose high2 does not exceed high1, the retracement price for the others
+# The default variant (entry_offset=0, no target, no stop) is Strategy 1, see elliott_wave_theory.build_result_df.
+# A target or stop crossed at the open fills at the open, a candle reaching both counts as stopped.
+# Trades that would enter after their wave's exit row are skipped.
+# The wave outcome comes from the detector, and the first row reaching a target or a stop is a binary search
+# on range maxima (RangeMax of the highs, and of the negated lows), so no price path is walked per variant.
+
+def rule_variants(entry_offsets=(0,), target_ratios=(None,), target_levels=(None,), stop_ratios=(None,)):
+    # Every combination of the rule parameters, one row per variant
+    return pd.DataFrame(
+        list(itertools.product(entry_offsets, target_ratios, target_levels, stop_ratios)),
+        columns=['entry_offset', 'target_ratio', 'target_level', 'stop_ratio']
+    )
+
+def trade_order(waves):
+    # Trades are ordered by the row their wave exits on, so the equity curve runs in time
+    return np.lexsort((waves['low2_index'], waves['retracement_index']))
+
+def first_reaching(range_max, lo, hi, level):
+    # First row r in [lo, hi] whose value in 'range_max' is >= level, -1 if there is none (or for NaN levels).
+    # A binary search on the maximum from lo, each step halves every open range at once.
+    lo, hi, level = np.broadcast_arrays(np.asarray(lo, dtype=np.int64), np.asarray(hi, dtype=np.int64), np.asarray(level, dtype=float))
+    shape = lo.shape
+    lo, hi, level = lo.ravel(), hi.ravel(), level.ravel()
+    row = np.full(len(lo), -1, dtype=np.int64)
+    searched = np.flatnonzero(lo <= hi)
+    searched = searched[range_max.max(lo[searched], hi[searched]) >= level[searched]]
+    left, right = lo[searched], hi[searched].copy()
+    open_ranges = np.flatnonzero(left < right)
+    while len(open_ranges):
+        middle = (left[open_ranges] + right[open_ranges]) // 2
+        reached = range_max.max(lo[searched[open_ranges]], middle) >= level[searched[open_ranges]]
+        right[open_ranges] = np.where(reached, middle, right[open_ranges])
+        left[open_ranges] = np.where(reached, left[open_ranges], middle + 1)
+        open_ranges = open_ranges[left[open_ranges] < right[open_ranges]]
+    row[searched] = left
+    return row.reshape(shape)
+
+def rule_profits(df, waves, entry_offset=0, target_ratios=(None,), range_max=None, target_levels=None, stop_ratios=None, range_min=None):
+    # Profit of every wave's trade for one entry offset and several (target_ratio, target_level, stop_ratio) rows,
+    # 'target_levels' and 'stop_ratios' are None on every row when they are not given.
+    # 'range_max' / 'range_min' are the RangeMax of df['high'] / of -df['low'], pass them to share them between calls.
+    # Returns (profits, traded): profits has one row per rule row (0 for skipped trades), traded marks the waves entered.
+    if range_max is None:
+        range_max = RangeMax(df['high'])
+    rows = len(target_ratios)
+    target_levels = [None] * rows if target_levels is None else target_levels
+    stop_ratios = [None] * rows if stop_ratios is None else stop_ratios
+    open = df['open'].to_numpy(dtype=float)
+    exit_index = waves['retracement_index']
+    entry_index = waves['low2_index'] + 2 + entry_offset
+    traded = entry_index <= exit_index
+    entry = open[np.minimum(entry_index, len(open) - 1)]
+
+    # Strategy 1 exits
+    win = waves['high2_price'] > waves['high1_price']
+    exit_price = np.where(win, waves['retracement_price'], waves['low1_price'])
+
+    def parameter(values):
+        return np.array([np.nan if value is None else value for value in values], dtype=float)[:, None]
+
+    wave1 = waves['high1_price'] - waves['low1_price']
+    target = np.fmin(waves['low2_price'] + wave1 * parameter(target_ratios), waves['high1_price'] - wave1 * parameter(target_levels))
+    stop = waves['high1_price'] - wave1 * parameter(stop_ratios)
+    if range_min is None and not np.isnan(stop).all():
+        range_min = RangeMax(-df['low'].to_numpy(dtype=float))
+    # Targets count up to the row before the exit, stops up to the exit row, where the low can pass the stop before the exit price
+    target_row = first_reaching(range_max, entry_index, exit_index - 1, target)
+    stop_row = first_reaching(range_min, entry_index, exit_index, -stop) if range_min is not None else np.full(target.shape, -1)
+    stopped = (stop_row >= 0) & ((target_row < 0) | (stop_row <= target_row))
+    hit = (target_row >= 0) & ~stopped
+
+    profits = np.where(
+        hit, np.maximum(target, open[target_row]),
+        np.where(stopped, np.minimum(stop, open[stop_row]), exit_price)
+    ) - entry
+    return np.where(traded, profits, 0.0), traded
+
+def backtest(df, waves, variants=None):
+    # Evaluates every rule variant (see rule_variants) over all waves of 'df'.
+    # Returns (summary, equity): one summary row per variant, and the (variants, waves) equity curves in trade order.
+    if variants is None:
+        variants = rule_variants()
+    waves = waves[trade_order(waves)]
+    range_max = RangeMax(df['high'])
+    range_min = RangeMax(-df['low'].to_numpy(dtype=float))
+    profits = np.zeros((len(variants), len(waves)))
+    traded = np.zeros((len(variants), len(waves)), dtype=bool)
+    entry_offsets = variants['entry_offset'].to_numpy()
+    # Variants built without some rule parameter (e.g. by hand) have None for it
+    parameters = {name: variants[name].to_numpy() if name in variants else np.full(len(variants), None) for name in ('target_ratio', 'target_level', 'stop_ratio')}
+    for entry_offset in np.unique(entry_offsets):
+        rows = np.flatnonzero(entry_offsets == entry_offset)
+        profits[rows], traded[rows] = rule_profits(
+            df, waves, int(entry_offset), parameters['target_ratio'][rows].tolist(), range_max,
+            parameters['target_level'][rows].tolist(), parameters['stop_ratio'][rows].tolist(), range_min
+        )
+
+    equity = np.cumsum(profits, axis=1)
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0), axis=1) - equity if len(waves) else np.zeros((len(variants), 0))
+    trades = traded.sum(axis=1)
+    wins = (traded & (profits > 0)).sum(axis=1)
+    losses = (traded & (profits < 0)).sum(axis=1)
+    gains = np.where(profits > 0, profits, 0).sum(axis=1)
+    lost = np.where(profits < 0, profits, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary = variants.assign(
+            trades=trades,
+            wins=wins,
+            losses=losses,
+            win_rate=np.where(trades > 0, wins / trades, 0),
+            average_win=gains / wins,
+            average_loss=lost / losses,
+            expectancy=np.where(trades > 0, profits.sum(axis=1) / trades, 0),
+            total_profit=equity[:, -1] if len(waves) else 0.0,
+            max_drawdown=drawdown.max(axis=1, initial=0),
+        )
+    return summary, equity
+
+def print_backtest_results(summary, top=10, sort_by='expectancy'):
+    # Prints the best 'top' variants
+    print(f"\nBacktest of {len(summary)} rule variants, best {min(top, len(summary))} by {sort_by}:\n")
+    print(summary.sort_values(sort_by, ascending=False).head(top).to_string(index=False))
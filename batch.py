@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import matplotlib
+import numpy as np
+import pandas as pd
+from elliott_wave_theory import build_result_df, detect, load_file
+from streaming import detect_chunked
+import kernels
+try:
+    import resource
+except ImportError:     # Windows, memory limits are not available
+    resource = None
+
+# Batch runs of the waves detection over many symbols and timeframes.
+#
+#   python batch.py manifest.csv --output results --workers 8 --memory-limit-mb 4096
+#
+# The manifest lists one file per (symbol, timeframe), as a CSV or a JSON list with 'symbol', 'timeframe' and 'file':
+#   symbol,timeframe,file
+#   BTCUSD,1h,data/btc_historical.csv
+#   ETHUSD,1h,data/eth_historical.csv
+#
+# Tasks run in one process pool with at most 'max_pending' of them queued at a time, and every worker process
+# is limited to 'memory_limit_mb' of address space, so a file too large for it fails with a MemoryError
+# instead of taking the machine down. The Numba kernels are compiled before the limit is set (see kernels.warm_up),
+# as the JIT aborts the process rather than raising when it runs out of memory. A worker that dies anyway
+# breaks the pool: the tasks it was running with are recorded as failed and the batch goes on in a new pool.
+# All results go to one Parquet dataset partitioned by symbol: {output}/symbol={symbol}/{timeframe}.parquet,
+# which pd.read_parquet(output) reads back as one DataFrame with a 'symbol' column.
+# {output}/_batch_summary.csv has one row per task with its status, wave counts, time and error
+# (the leading underscore keeps Parquet readers from taking it for part of the dataset).
+
+def read_manifest(filename):
+    if filename.endswith('.json'):
+        with open(filename) as f:
+            tasks = json.load(f)
+    else:
+        tasks = pd.read_csv(filename, dtype=str).to_dict('records')
+    for task in tasks:
+        missing = [key for key in ('symbol', 'timeframe', 'file') if not isinstance(task.get(key), str) or not task[key]]
+        if missing:
+            raise ValueError(f"Manifest entry {task} has no {', '.join(missing)}")
+    return tasks
+
+def init_batch_worker(memory_limit_mb=None):
+    matplotlib.use('Agg')
+    if memory_limit_mb is not None and resource is not None:
+        kernels.warm_up()
+        limit = int(memory_limit_mb) * 2 ** 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_task(task, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000, chunksize=None):
+    # Detection for one manifest entry, nothing is written or printed by the worker.
+    # With 'chunksize', the file is streamed in chunks (see streaming.detect_chunked) instead of loaded whole.
+    # Returns (the result DataFrame of build_result_df with a 'timeframe' column, wave counts and time of the task)
+    start = time.perf_counter()
+    if chunksize is not None:
+        success_waves, failure_waves, result_df = detect_chunked(task['file'], chunksize, retracement_ratio, high2_retracement_ratio, reset_threshold)
+    else:
+        df, local_lows, local_highs, success_waves, failure_waves = detect(load_file(task['file']), retracement_ratio, high2_retracement_ratio, reset_threshold, verbose=False)
+        result_df = build_result_df(df, np.concatenate([success_waves, failure_waves]))
+    result_df = result_df.reset_index(drop=True)
+    result_df.insert(0, 'timeframe', task['timeframe'])
+    summary = {
+        'success_waves': len(success_waves),
+        'failure_waves': len(failure_waves),
+        'seconds': time.perf_counter() - start,
+    }
+    return result_df, summary
+
+def partition_filename(output, symbol, timeframe):
+    return os.path.join(output, f"symbol={symbol}", f"{timeframe}.parquet")
+
+def save_partition(result_df, output, symbol, timeframe):
+    # Written to a temporary file first, so readers of the dataset never see a half written partition
+    filename = partition_filename(output, symbol, timeframe)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f"{filename}.tmp"
+    result_df.to_parquet(tmp_filename, index=False)
+    os.replace(tmp_filename, filename)
+    return filename
+
+def run_batch(manifest, output='batch_results', workers=None, max_pending=None, memory_limit_mb=None,
+              retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000, chunksize=None):
+    # Runs every task of 'manifest' (a filename or a list of tasks) and writes the results dataset.
+    # At most 'max_pending' tasks (2 per worker by default) are submitted at once, so a manifest of thousands of files
+    # never queues thousands of futures. A task that fails, or whose worker dies, is recorded and the batch goes on.
+    # Returns the summary DataFrame, one row per task in manifest order.
+    tasks = read_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    parameters = (retracement_ratio, high2_retracement_ratio, reset_threshold, chunksize)
+    os.makedirs(output, exist_ok=True)
+    summaries = [None] * len(tasks)
+
+    def record(n, status, error=None, summary=None):
+        task = tasks[n]
+        summaries[n] = {'symbol': task['symbol'], 'timeframe': task['timeframe'], 'file': task['file'], 'status': status,
+                        **(summary or {'success_waves': 0, 'failure_waves': 0, 'seconds': 0.0}), 'error': error}
+        print(f"[{sum(s is not None for s in summaries)}/{len(tasks)}] {task['symbol']} {task['timeframe']}: {status}" + (f" ({error})" if error else ""))
+
+    next_task = 0
+    while next_task < len(tasks):
+        # A worker killed by the system breaks the pool, the remaining tasks go to a new one
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker, initargs=(memory_limit_mb,))
+        pending = {}
+        try:
+            while next_task < len(tasks) or pending:
+                while next_task < len(tasks) and len(pending) < max_pending:
+                    pending[executor.submit(run_task, tasks[next_task], *parameters)] = next_task
+                    next_task += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                broken = None
+                for future in done:
+                    # Popped only once the result is in, so a broken pool still records this task below
+                    n = pending[future]
+                    try:
+                        result_df, summary = future.result()
+                    except BrokenProcessPool as error:
+                        # The other finished tasks are saved before the pool is given up
+                        broken = error
+                        continue
+                    except Exception as error:
+                        del pending[future]
+                        record(n, 'failed', f"{type(error).__name__}: {error}")
+                        continue
+                    del pending[future]
+                    save_partition(result_df, output, tasks[n]['symbol'], tasks[n]['timeframe'])
+                    record(n, 'done', summary=summary)
+                if broken is not None:
+                    raise broken
+        except BrokenProcessPool as error:
+            for n in pending.values():
+                record(n, 'failed', f"{type(error).__name__}: {error}")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    summary_df = pd.DataFrame(summaries)
+    summary_df.to_csv(os.path.join(output, '_batch_summary.csv'), index=False)
+    return summary_df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect waves for every (symbol, timeframe, file) of a manifest.")
+    parser.add_argument('manifest', help="CSV or JSON list with symbol, timeframe and file")
+    parser.add_argument('--output', default='batch_results', help="folder of the Parquet dataset")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-pending', type=int, default=None, help="tasks queued at once (default: 2 per worker)")
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help="address space limit of every worker")
+    parser.add_argument('--retracement-ratio', type=float, default=0.618)
+    parser.add_argument('--high2-retracement-ratio', type=float, default=0.382)
+    parser.add_argument('--reset-threshold', type=int, default=100000)
+    parser.add_argument('--chunksize', type=int, default=None, help="stream files in chunks of this many rows")
+    args = parser.parse_args(argv)
+
+    summary_df = run_batch(
+        args.manifest, args.output, args.workers, args.max_pending, args.memory_limit_mb,
+        args.retracement_ratio, args.high2_retracement_ratio, args.reset_threshold, args.chunksize
+    )
+    failed = summary_df[summary_df['status'] != 'done']
+    print(f"\n{len(summary_df) - len(failed)} tasks done, {len(failed)} failed. Results: {args.output}")
+    return 1 if len(failed) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
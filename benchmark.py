@@ -0,0 +1,385 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import itertools
+import shutil
+import hashlib
+import argparse
+import platform
+import contextlib
+import numpy as np
+import pandas as pd
+import matplotlib
+import elliott_wave_theory
+import analyze
+import kernels
+from profiling import Profiler
+
+# Reproducible benchmarks of the detection pipeline on synthetic OHLC data.
+#
+#   python benchmark.py --sizes 10000 100000                 # time every stage of run() and process_data() end to end
+#   python benchmark.py --baseline old_report.json           # compare timings with an earlier report
+#   python benchmark.py --update-golden                      # store the current results as the golden output
+#
+# Tiny files on which nothing is detected (see write_edge_cases) are run on every benchmark too.
+#
+#   python benchmark.py --check-workers                      # check that parallel process_data() writes the serial run's per-block files
+#   python benchmark.py --check-kernels                      # check the numba kernels against the pure-Python backend
+#                                                            # on the benchmark walk and on random flat bottom / reset threshold cases
+#
+# Every case's results are hashed and checked against benchmark_golden.json, so correctness drift shows up
+# in the same report as performance regressions. The exit status is 1 if any case drifted.
+
+# Market regimes of the random walk: (drift, volatility) of the log return per candle
+REGIMES = {
+    'bull': (0.0003, 0.008),
+    'bear': (-0.0003, 0.010),
+    'sideways': (0.0, 0.005),
+}
+CHUNK_SIZE = 1_000_000
+
+def iter_ohlc(n, seed=0, start_price=20000.0, start_unix=1577836800, interval=3600, mean_regime_length=500):
+    # Seeded random walk with regimes, yielded in DataFrames of CHUNK_SIZE candles so 50M candles never sit in memory at once.
+    # Regimes switch after geometric lengths (mean 'mean_regime_length' candles). Prices are rounded to cents,
+    # which gives equal lows (flat bottoms) and ties like real exchange data.
+    rng = np.random.default_rng(seed)
+    names = list(REGIMES)
+    drift = np.array([REGIMES[name][0] for name in names])
+    volatility = np.array([REGIMES[name][1] for name in names])
+    price, regime, regime_left = start_price, 0, 0
+    for chunk_start in range(0, n, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n - chunk_start)
+
+        # Regime of every candle in the chunk
+        regimes = np.empty(size, dtype=np.int64)
+        filled = 0
+        while filled < size:
+            if regime_left == 0:
+                regime = int(rng.integers(len(names)))
+                regime_left = int(rng.geometric(1 / mean_regime_length))
+            length = min(regime_left, size - filled)
+            regimes[filled:filled + length] = regime
+            filled += length
+            regime_left -= length
+
+        log_returns = drift[regimes] + volatility[regimes] * rng.standard_normal(size)
+        close = price * np.exp(np.cumsum(log_returns))
+        open = np.concatenate([[price], close[:-1]])
+        wick = volatility[regimes] / 2
+        high = np.maximum(open, close) * (1 + np.abs(rng.standard_normal(size)) * wick)
+        low = np.minimum(open, close) * (1 - np.abs(rng.standard_normal(size)) * wick)
+        price = close[-1]
+
+        open, close = np.round(open, 2), np.round(close, 2)
+        yield pd.DataFrame({
+            'unix': start_unix + interval * np.arange(chunk_start, chunk_start + size, dtype=np.int64),
+            'open': open,
+            'high': np.maximum(np.round(high, 2), np.maximum(open, close)),
+            'low': np.minimum(np.round(low, 2), np.minimum(open, close)),
+            'close': close,
+            'Volume': np.round(rng.lognormal(3, 1, size), 4),
+        })
+
+def generate_ohlc(n, seed=0, **kwargs):
+    # The whole synthetic file as one DataFrame
+    return pd.concat(iter_ohlc(n, seed, **kwargs), ignore_index=True)
+
+def write_ohlc(filename, n, seed=0, **kwargs):
+    # Writes the synthetic file chunk by chunk, in the column layout of the exchange CSVs (unix, open, high, low, close, Volume)
+    for i, chunk in enumerate(iter_ohlc(n, seed, **kwargs)):
+        chunk.to_csv(filename, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+    return filename
+
+def write_edge_cases(folder, seed=0):
+    # Tiny files on which nothing is detected, every output must still be written (empty) instead of failing:
+    #   edge_3_candles : the first three candles of the synthetic walk, too short for any wave
+    #   edge_uptrend   : 50 candles rising one after another, without a single local low
+    # Returns {case name: filename}
+    uptrend = np.round(20000 * 1.001 ** np.arange(51), 2)
+    frames = {
+        'edge_3_candles': generate_ohlc(3, seed),
+        'edge_uptrend': pd.DataFrame({
+            'unix': 1577836800 + 3600 * np.arange(50, dtype=np.int64),
+            'open': uptrend[:-1],
+            'high': uptrend[1:],
+            'low': uptrend[:-1],
+            'close': uptrend[1:],
+            'Volume': np.ones(50),
+        }),
+    }
+    filenames = {}
+    for name, df in frames.items():
+        filenames[name] = os.path.join(folder, f"{name}.csv")
+        df.to_csv(filenames[name], index=False)
+    return filenames
+
+def waves_digest(success_waves, failure_waves):
+    # Counts and hashes of the detected waves, compared against the golden output
+    return {
+        'success_waves': len(success_waves),
+        'failure_waves': len(failure_waves),
+        'success_sha1': hashlib.sha1(success_waves.tobytes()).hexdigest(),
+        'failure_sha1': hashlib.sha1(failure_waves.tobytes()).hexdigest(),
+    }
+
+def benchmark_run(filename, memory=False, outputs=('result',), **parameters):
+    # Times every stage of elliott_wave_theory.run() on 'filename' (outputs are written next to it)
+    # The file is loaded here and run() only gets its base name, so outputs are named the same whatever folder it is in.
+    profiler = Profiler(filename, trace_memory=memory)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with profiler.stage('load_file') as stage:
+            df = elliott_wave_theory.load_file(filename)
+            stage['rows'] = len(df)
+        success_waves, failure_waves = elliott_wave_theory.run(
+            os.path.basename(filename), folder=os.path.dirname(filename) or '.', df=df, outputs=outputs, profiler=profiler, **parameters
+        )
+    report = profiler.report()
+    return {
+        'seconds': time.perf_counter() - start,
+        'peak_memory_mb': report['peak_memory_mb'] if memory else None,
+        'stages': {record['stage']: record['seconds'] for record in report['stages']},
+        'counts': {record['stage']: {k: v for k, v in record.items() if k not in ('stage', 'depth', 'seconds', 'peak_memory_mb')} for record in report['stages']},
+        'digest': waves_digest(success_waves, failure_waves),
+    }
+
+def benchmark_process_data(filename, seed=0, number_of_splits=30, workers=None, **parameters):
+    # Times analyze.process_data() end to end with block sampling, purely in memory.
+    # The printed analysis is the result that is checked against the golden output.
+    random.seed(seed)
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        analyze.process_data(
+            filename,
+            conduct_block_sampling=True,
+            number_of_splits=number_of_splits,
+            output_folder=os.path.dirname(filename) or '.',
+            workers=workers,
+            outputs=(),
+            **parameters
+        )
+    lines = [line for line in output.getvalue().splitlines() if line and not line.startswith('search_high2')]
+    return {
+        'seconds': time.perf_counter() - start,
+        'digest': {'lines': len(lines), 'output_sha1': hashlib.sha1('\n'.join(lines).encode()).hexdigest()},
+    }
+
+def block_artifacts_parity(filename, seed=0, number_of_splits=12, workers=2, resamples=200):
+    # Runs process_data() with block sampling and resampling serially and with 'workers' processes, with profiles and windowed charts,
+    # in two folders next to 'filename'. The per-block files must be the same: the same names, and the result CSVs byte for byte.
+    # Returns {'match': bool, 'files': number of files of the serial run, 'missing': serial files the parallel run did not write, ...}
+    # process_data() names its outputs after 'filename', so it runs from the file's folder
+    data_folder = os.path.abspath(os.path.dirname(filename) or '.')
+    base_folder = os.path.join(data_folder, f"block_artifacts_{seed}")
+    files = {}
+    for name, run_workers in (('serial', None), ('parallel', workers)):
+        folder = os.path.join(base_folder, name)
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        random.seed(seed)
+        with contextlib.chdir(data_folder), contextlib.redirect_stdout(io.StringIO()):
+            analyze.process_data(
+                os.path.basename(filename), conduct_block_sampling=True, number_of_splits=number_of_splits, output_folder=folder, workers=run_workers,
+                outputs=('result', 'chart'), profile=True, chart_windows=True, resamples=resamples, resample_seed=seed
+            )
+        files[name] = {
+            os.path.relpath(os.path.join(root, file), folder): os.path.join(root, file)
+            for root, _, names in os.walk(folder) for file in names if not file.endswith('_process_data_profile.json')
+        }
+    missing = sorted(set(files['serial']) - set(files['parallel']))
+    extra = sorted(set(files['parallel']) - set(files['serial']))
+    different = sorted(
+        file for file in set(files['serial']) & set(files['parallel'])
+        if file.endswith('_result.csv') and open(files['serial'][file], 'rb').read() != open(files['parallel'][file], 'rb').read()
+    )
+    return {'match': not (missing or extra or different), 'files': len(files['serial']), 'missing': missing, 'extra': extra, 'different': different}
+
+def kernel_parity(df, reset_thresholds=(100000, 3, 1), high2_retracement_ratios=(0.382, -0.2, 1.0)):
+    # Runs detect() with every backend of kernels.py and compares the local lows and the waves byte for byte.
+    # Returns {'reset_threshold=../high2_retracement_ratio=..': {'match': bool, backend: seconds}}
+    if kernels.njit is None:
+        return {}
+    previous_backend = kernels.backend
+    results = {}
+    try:
+        for reset_threshold, high2_retracement_ratio in itertools.product(reset_thresholds, high2_retracement_ratios):
+            outputs = {}
+            timings = {}
+            for backend in kernels.BACKENDS:
+                kernels.set_backend(backend)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    _, local_lows, _, success_waves, failure_waves = elliott_wave_theory.detect(df, 0.618, high2_retracement_ratio, reset_threshold)
+                timings[backend] = time.perf_counter() - start
+                fields = [getattr(local_lows, field) for field in elliott_wave_theory.LocalLows.__slots__]
+                outputs[backend] = [(array.dtype.str, array.tobytes()) for array in fields + [success_waves, failure_waves]]
+            match = all(outputs[backend] == outputs[kernels.BACKENDS[0]] for backend in kernels.BACKENDS)
+            results[f"reset_threshold={reset_threshold}/high2_retracement_ratio={high2_retracement_ratio}"] = dict(timings, match=match)
+    finally:
+        kernels.backend = previous_backend
+    return results
+
+def random_parity_cases(size, seed=0, cases=6):
+    # Randomized inputs for kernel_parity on top of the benchmark walk, yields (name, df, reset_thresholds, high2_retracement_ratios).
+    # Every other frame has flat bottoms: prices snapped to a coarse tick, so lows repeat and form plateaus.
+    # Reset thresholds are drawn small, so the local lows stack is cleared often, and ratios include negative ones and ones above 1.
+    rng = np.random.default_rng(seed)
+    for case in range(cases):
+        df = generate_ohlc(size, seed + 1 + case)
+        flat_bottoms = case % 2 == 0
+        if flat_bottoms:
+            # Rounding is monotone, so highs stay above and lows below open and close
+            tick = float(rng.choice([5.0, 25.0, 100.0]))
+            for column in ('open', 'high', 'low', 'close'):
+                df[column] = np.round(df[column] / tick) * tick
+        reset_thresholds = tuple(int(threshold) for threshold in rng.integers(1, 8, 2)) + (100000,)
+        high2_retracement_ratios = tuple(float(ratio) for ratio in np.round(rng.uniform(-0.5, 1.5, 2), 3))
+        yield f"random_{case}_{'flat_bottoms' if flat_bottoms else 'walk'}", df, reset_thresholds, high2_retracement_ratios
+
+def compare(report, golden=None, baseline=None, tolerance=0.25, min_seconds=0.05):
+    # Adds 'golden' (ok / drift / missing) and per stage baseline ratios to every case of 'report'.
+    # A stage regressed if it is 'tolerance' slower than the baseline and by more than 'min_seconds'.
+    for name, case in report['cases'].items():
+        if golden is not None:
+            expected = golden.get('cases', {}).get(name)
+            case['golden'] = 'missing' if expected is None else 'ok' if expected == case['digest'] else 'drift'
+        baseline_case = (baseline or {}).get('cases', {}).get(name)
+        if baseline_case is None:
+            continue
+        current_stages = dict(case.get('stages', {}), total=case['seconds'])
+        baseline_stages = dict(baseline_case.get('stages', {}), total=baseline_case['seconds'])
+        case['comparison'] = {}
+        for stage, seconds in current_stages.items():
+            if stage not in baseline_stages:
+                continue
+            before = baseline_stages[stage]
+            case['comparison'][stage] = {
+                'baseline_seconds': before,
+                'ratio': seconds / before if before > 0 else None,
+                'regressed': seconds > before * (1 + tolerance) and seconds - before > min_seconds,
+            }
+    return report
+
+def print_report(report):
+    for name, case in report['cases'].items():
+        memory = f", peak {case['peak_memory_mb']:.1f} MB" if case.get('peak_memory_mb') is not None else ''
+        print(f"\n{name}: {case['seconds']:.3f}s{memory}, golden: {case.get('golden', 'not checked')}")
+        comparison = case.get('comparison', {})
+        for stage, seconds in dict(case.get('stages', {}), total=case['seconds']).items():
+            line = f"  {stage:<50} {seconds:>10.4f}s"
+            if stage in comparison:
+                ratio = comparison[stage]['ratio']
+                line += f"  baseline {comparison[stage]['baseline_seconds']:>10.4f}s"
+                line += f"  x{ratio:.2f}" if ratio is not None else ''
+                line += "  REGRESSED" if comparison[stage]['regressed'] else ''
+            print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Elliott wave detection pipeline on synthetic OHLC data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000], help="candles per synthetic file (10k to 50M)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--folder', default='benchmark_data', help="where synthetic files and outputs are written")
+    parser.add_argument('--reset-threshold', type=int, default=100000)
+    parser.add_argument('--outputs', nargs='*', default=['result'], help="files written by run(): result, processed, chart")
+    parser.add_argument('--skip-process-data', action='store_true', help="only benchmark run()")
+    parser.add_argument('--number-of-splits', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--memory', action='store_true', help="trace peak memory per stage (slower)")
+    parser.add_argument('--golden', default='benchmark_golden.json')
+    parser.add_argument('--update-golden', action='store_true', help="store this run's results as the golden output")
+    parser.add_argument('--baseline', default=None, help="earlier report to compare timings with")
+    parser.add_argument('--report', default='benchmark_report.json')
+    parser.add_argument('--check-workers', action='store_true', help="compare the per-block files of serial and parallel process_data() runs on a 2,000 candle file")
+    parser.add_argument('--check-kernels', action='store_true', help="compare the numba and pure-Python backends on every size")
+    args = parser.parse_args(argv)
+    matplotlib.use('Agg')
+
+    os.makedirs(args.folder, exist_ok=True)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'cases': {},
+    }
+    parameters = {'reset_threshold': args.reset_threshold}
+    for size in args.sizes:
+        case = f"{size}/{args.seed}/reset_threshold={args.reset_threshold}"
+        filename = os.path.join(args.folder, f"synthetic_{size}_{args.seed}.csv")
+        if not os.path.exists(filename):
+            start = time.perf_counter()
+            write_ohlc(filename, size, args.seed)
+            print(f"Generated {filename} in {time.perf_counter() - start:.1f}s")
+        report['cases'][f"run/{case}"] = dict(benchmark_run(filename, args.memory, tuple(args.outputs), **parameters), rows=size)
+        if args.check_kernels:
+            report.setdefault('kernel_parity', {}).update({
+                f"{size}/{args.seed}/{name}": result for name, result in kernel_parity(generate_ohlc(size, args.seed)).items()
+            })
+        if not args.skip_process_data:
+            report['cases'][f"process_data/{case}/splits={args.number_of_splits}"] = dict(
+                benchmark_process_data(filename, args.seed, args.number_of_splits, args.workers, **parameters), rows=size
+            )
+
+    if args.check_kernels:
+        for case_name, df, reset_thresholds, high2_retracement_ratios in random_parity_cases(20_000, args.seed):
+            report.setdefault('kernel_parity', {}).update({
+                f"{case_name}/{args.seed}/{name}": result
+                for name, result in kernel_parity(df, reset_thresholds, high2_retracement_ratios).items()
+            })
+    if args.check_workers:
+        # A small file of its own: every wave of every sampled block gets a chart window
+        filename = write_ohlc(os.path.join(args.folder, f"synthetic_2000_{args.seed}.csv"), 2000, args.seed)
+        report['block_artifacts'] = block_artifacts_parity(filename, args.seed, 12, args.workers or 2)
+    for name, filename in write_edge_cases(args.folder, args.seed).items():
+        report['cases'][f"run/{name}"] = dict(benchmark_run(filename, False, ('result', 'processed'), **parameters), rows=len(pd.read_csv(filename)))
+
+    golden = None
+    if args.update_golden:
+        golden = {'cases': {}}
+        if os.path.exists(args.golden):
+            with open(args.golden) as f:
+                golden = json.load(f)
+        golden['cases'].update({name: case['digest'] for name, case in report['cases'].items()})
+        with open(args.golden, 'w') as f:
+            json.dump(golden, f, indent=2)
+        print(f"Golden output updated: {args.golden}")
+    elif os.path.exists(args.golden):
+        with open(args.golden) as f:
+            golden = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    compare(report, golden, baseline)
+    print_report(report)
+    if args.check_kernels:
+        if kernels.njit is None:
+            print("\nKernel parity: Numba is not installed, only the pure-Python backend is available")
+        else:
+            print("\nKernel parity:")
+        for name, result in report.get('kernel_parity', {}).items():
+            timings = '  '.join(f"{backend} {result[backend]:>8.4f}s" for backend in kernels.BACKENDS)
+            print(f"  {name:<60} {'ok' if result['match'] else 'MISMATCH':<8}  {timings}")
+    if 'block_artifacts' in report:
+        result = report['block_artifacts']
+        print(f"\nBlock artifacts, serial vs parallel: {'ok' if result['match'] else 'MISMATCH'} ({result['files']} files)")
+        for key in ('missing', 'extra', 'different'):
+            for file in result[key]:
+                print(f"  {key}: {file}")
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    drifted = any(case.get('golden') == 'drift' for case in report['cases'].values())
+    mismatched = any(not result['match'] for result in report.get('kernel_parity', {}).values())
+    mismatched = mismatched or not report.get('block_artifacts', {'match': True})['match']
+    return 1 if drifted or mismatched else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Columnar binary cache of loaded data.
+# Every array is stored as its own .npy file so it can be opened with np.load(mmap_mode='r') instead of re-parsed.
+# A cache folder belongs to one version of a source file: its path, modification time and size are part of the key,
+# so editing or replacing the source file starts a new folder.
+
+def source_key(filename):
+    # Key of the current version of a source file
+    stat = os.stat(filename)
+    key = f"{os.path.abspath(filename)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def cache_path(filename, cache_folder):
+    # Folder holding the cached arrays of 'filename', e.g. '.ohlc_cache/btc_historical_3f2a...'
+    base_name = os.path.basename(filename).split('.')[0]
+    return os.path.join(cache_folder, f"{base_name}_{source_key(filename)}")
+
+def has_array(path, name):
+    return os.path.exists(os.path.join(path, f"{name}.npy"))
+
+def save_array(path, name, array):
+    # Written to a temporary file first, so a reader never opens a half written array
+    os.makedirs(path, exist_ok=True)
+    array = np.asarray(array)
+    if array.dtype == object:
+        array = array.astype(str)
+    tmp_filename = os.path.join(path, f"{name}.tmp.npy")
+    np.save(tmp_filename, array)
+    os.replace(tmp_filename, os.path.join(path, f"{name}.npy"))
+
+def open_array(path, name, mmap=True):
+    return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None)
+
+def has_frame(path):
+    return os.path.exists(os.path.join(path, 'columns.json'))
+
+def save_frame(df, path):
+    # One array per column, 'columns.json' is written last and marks the frame as complete
+    for i, column in enumerate(df.columns):
+        save_array(path, f"column_{i}", df[column].to_numpy())
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump(list(df.columns), f)
+
+def open_frame(path, mmap=True):
+    # Read-only DataFrame whose columns are memory mapped from the cache
+    with open(os.path.join(path, 'columns.json')) as f:
+        columns = json.load(f)
+    return pd.DataFrame({column: open_array(path, f"column_{i}", mmap) for i, column in enumerate(columns)}, copy=False)
+
+# Content addressed memo of the detection stages (see elliott_wave_theory.detect).
+#
+#   memo = StageCache('.stage_cache', max_mb=1024)
+#   detect(df, retracement_ratio, high2_retracement_ratio, reset_threshold, memo=memo)
+#
+# An entry is keyed by the fingerprint of the prices it was computed from and the parameters its stage depends on,
+# so the same data reached from another file, block or run hits it, and changing a parameter only recomputes
+# the stages after it. Entries are folders of .npy files, '{stage}_{key}', whose modification time is their last use.
+# Once the folder grows over 'max_mb', the least recently used entries are removed.
+
+def fingerprint(*parts):
+    # sha1 of arrays (dtype, shape and bytes) and plain parameters
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f"{part.dtype.str}{part.shape}".encode())
+            digest.update(part.view(np.uint8).reshape(-1) if part.size else b'')
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'|')
+    return digest.hexdigest()[:24]
+
+class StageCache:
+    def __init__(self, folder, max_mb=1024):
+        self.folder = folder
+        self.max_bytes = int(max_mb * 2 ** 20)
+
+    def entry_path(self, stage, key):
+        return os.path.join(self.folder, f"{stage}_{key}")
+
+    def load(self, stage, key, names):
+        # The arrays of an entry in 'names' order, None if it is not (or no longer) cached
+        path = self.entry_path(stage, key)
+        try:
+            arrays = [np.load(os.path.join(path, f"{name}.npy")) for name in names]
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return arrays
+
+    def save(self, stage, key, arrays):
+        # 'arrays' is {name: array}. The entry is written to a temporary folder renamed in place,
+        # so readers (e.g. other block workers) never see half of it. The first writer of an entry wins.
+        path = self.entry_path(stage, key)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(array))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        # [(last use, bytes, path)] of the complete entries
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_dir() or '.tmp' in entry.name:
+                continue
+            try:
+                size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime_ns, size, entry.path))
+            except FileNotFoundError:   # removed by another process meanwhile
+                continue
+        return entries
+
+    def evict(self):
+        # Removes the least recently used entries until the folder fits in 'max_bytes'
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,44 @@
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+from elliott_wave_theory import CHART_TITLE, render_chart
+
+# Deferred chart rendering: charts are drawn by a pool of background processes, so the numeric results
+# of a run come back without waiting for mplfinance.
+#
+#   with ChartRenderer(workers=2) as chart_renderer:
+#       run(filename, chart_renderer=chart_renderer)     # returns as soon as the waves are detected
+#   # leaving the block waits for every chart
+#
+# Workers use the non-interactive Agg backend, so rendering never needs a display.
+
+def init_chart_worker():
+    matplotlib.use('Agg')
+
+class ChartRenderer:
+    def __init__(self, workers=1, title=CHART_TITLE):
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_chart_worker)
+        self.title = title
+        self.futures = []
+
+    def submit(self, df, filename, success_waves, failure_waves, chart_windows=False):
+        # Queues one chart (see elliott_wave_theory.render_chart), only the date and price columns are sent to the worker
+        chart_df = df[['date', 'open', 'high', 'low', 'close']]
+        future = self.executor.submit(render_chart, chart_df, filename, success_waves, failure_waves, chart_windows, self.title)
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        # Waits for every queued chart and returns the written filenames, a failed chart raises its error here
+        self.executor.shutdown(wait=True)
+        filenames = [filename for future in self.futures for filename in future.result()]
+        self.futures = []
+        return filenames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=False, cancel_futures=True)
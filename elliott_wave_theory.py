@@ -1,13 +1,32 @@
+import os
 import random
-import copy
+import heapq
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import mplfinance as mpf
 from scipy.signal import find_peaks
-from scipy.stats import pearsonr
+from scipy.stats import pearsonr, t
+import cache
+import kernels
+from profiling import Profiler
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # only the Parquet outputs need pyarrow
+    pa = pq = None
 
-def load_file(filename):
-    df = pd.read_csv(filename)
+def load_file(filename, cache_folder=None):
+    # With 'cache_folder', the normalized frame (after convert_UNIX_to_datetime) is cached as memory mapped columns,
+    # so later calls, and block workers, open it without parsing and sorting the CSV again.
+    if cache_folder is None:
+        df = pd.read_csv(filename)
+        return df
+
+    path = cache.cache_path(filename, cache_folder)
+    if not cache.has_frame(path):
+        cache.save_frame(convert_UNIX_to_datetime(pd.read_csv(filename)), path)
+    df = cache.open_frame(path)
     
     return df
 
@@ -27,10 +46,11 @@ def shift_column(df, column, number_of_shifts=1):
     return df
 
 def convert_UNIX_to_datetime(df):
+    # An already converted frame (e.g. from the cache) only has 'date' and is left as it is
 
-    if 'date' in df.columns:
-        df.drop(columns=['date'], inplace=True)
     if 'unix' in df.columns or 'time' in df.columns:
+        if 'date' in df.columns:
+            df.drop(columns=['date'], inplace=True)
         # Convert the Unix timestamp to a readable date
         time_column = 'unix' if 'unix' in df.columns else 'time'
         
@@ -40,7 +60,8 @@ def convert_UNIX_to_datetime(df):
         # Insert the 'date' column as the first column
         df.insert(0, 'date', df.pop('date'))
 
-    df.sort_values(by='date', inplace=True)
+    if not df['date'].is_monotonic_increasing:
+        df.sort_values(by='date', inplace=True)
     df.reset_index(drop=True, inplace=True)
 
     return df
@@ -90,33 +111,116 @@ def extract_all_local_lows(df):
                     seen_indices.add(index)
     return local_lows
 
+GREEN_RED = ["red", "doji", "green"]
+
 def add_green_red(df):
-    green_red = []
-    for i,row in df.iterrows():
-        close = row['close']
-        open = row['open']
-        if close > open:
-            green_red.append("green")
-        elif close < open:
-            green_red.append("red")
-        else:
-            green_red.append("doji")
-    df['green_red'] = green_red
+    # Candle color as a categorical column: "red" (close < open), "doji" or "green" (close > open).
+    # The categories are in np.sign(close - open) order, so the int8 codes are the sign + 1.
+    sign = np.sign(df['close'].to_numpy(dtype=float) - df['open'].to_numpy(dtype=float))
+    codes = np.nan_to_num(sign).astype(np.int8) + 1     # nan_to_num turns the NaN sign of missing prices into 0, so they count as doji
+    df['green_red'] = pd.Categorical.from_codes(codes, categories=GREEN_RED)
 
     return df
 
-def add_tail_range(df):
-    tail_range = []
-    for i,row in df.iterrows():
-        green_red = row['green_red']
-        if green_red == "red":
-            tail_range.append(f"{row['low']}, {row['close']}")
+def add_tail_range(df, legacy=False):
+    # Tail range of every candle as two float columns: 'tail_low' (low) and 'tail_high' (close of red candles, open otherwise)
+    # With 'legacy', also the old "low, close" string column 'tail_range', e.g. for the processed CSV
+    red = (df['green_red'] == "red").to_numpy()
+    df['tail_low'] = df['low'].to_numpy(dtype=float)
+    df['tail_high'] = np.where(red, df['close'].to_numpy(dtype=float), df['open'].to_numpy(dtype=float))
+    if legacy:
+        tail_range = [f"{low}, {close if is_red else open}" for low, close, open, is_red in zip(
+            df['low'].tolist(), df['close'].tolist(), df['open'].tolist(), red.tolist()
+        )]
+        if 'tail_range' in df.columns:
+            df['tail_range'] = tail_range
         else:
-            tail_range.append(f"{row['low']}, {row['open']}")
-    df['tail_range'] = tail_range
+            df.insert(df.columns.get_loc('tail_high') + 1, 'tail_range', tail_range)
 
     return df
 
+class RangeMax:
+    # Range maximum index over one price column (e.g. 'high').
+    # argmax(lo, hi) returns the row of the highest value between rows lo and hi (both inclusive) in O(1),
+    # picking the first row on ties like pandas' idxmax(). Queries can be scalars or whole arrays.
+    # It is a sparse table over blocks of BLOCK rows plus in-block prefix/suffix maxima,
+    # so memory stays around 2n + (n / BLOCK) * log2(n / BLOCK) indices.
+    BLOCK = 32
+    __slots__ = ('values', 'prefix', 'suffix', 'table')
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        self.values = np.where(np.isnan(values), -np.inf, values)
+        block = self.BLOCK
+        n_blocks = max(1, -(-len(values) // block))
+        blocks = np.full(n_blocks * block, -np.inf)
+        blocks[:len(values)] = self.values
+        blocks = blocks.reshape(n_blocks, block)
+        columns = np.arange(block)
+        block_start = (np.arange(n_blocks) * block)[:, None]
+
+        # prefix[j]: first highest row from the start of j's block up to j
+        running_max = np.maximum.accumulate(blocks, axis=1)
+        previous_max = np.hstack([np.full((n_blocks, 1), -np.inf), running_max[:, :-1]])
+        prefix = np.maximum.accumulate(np.where(blocks > previous_max, columns, 0), axis=1)
+        self.prefix = (block_start + prefix).ravel()
+
+        # suffix[j]: first highest row from j up to the end of j's block
+        suffix_max = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1]
+        next_max = np.hstack([suffix_max[:, 1:], np.full((n_blocks, 1), -np.inf)])
+        leads = np.where(blocks >= next_max, columns, block)
+        suffix = np.minimum.accumulate(leads[:, ::-1], axis=1)[:, ::-1]
+        self.suffix = (block_start + suffix).ravel()
+
+        # table[k][b]: first highest row within blocks b .. b + 2**k - 1
+        self.table = [self.prefix.reshape(n_blocks, block)[:, -1]]
+        width = 1
+        while width * 2 <= n_blocks:
+            level = self.table[-1]
+            self.table.append(self._first_highest(level[:-width], level[width:]))
+            width *= 2
+
+    def _first_highest(self, left, right):
+        return np.where(self.values[left] >= self.values[right], left, right)
+
+    def argmax(self, lo, hi):
+        # Returns -1 for empty ranges (lo > hi)
+        scalar = np.ndim(lo) == 0 and np.ndim(hi) == 0
+        lo, hi = np.broadcast_arrays(np.asarray(lo, dtype=np.int64), np.asarray(hi, dtype=np.int64))
+        lo, hi = lo.ravel(), hi.ravel()
+        block = self.BLOCK
+        result = np.full(len(lo), -1, dtype=np.int64)
+        lo_block, hi_block = lo // block, hi // block
+
+        # Both ends in the same block: scan the (at most BLOCK wide) window directly
+        same = np.flatnonzero((lo_block == hi_block) & (lo <= hi))
+        if len(same):
+            window = lo[same, None] + np.arange(block)
+            inside = window <= hi[same, None]
+            window_values = np.where(inside, self.values[np.minimum(window, len(self.values) - 1)], -np.inf)
+            result[same] = lo[same] + window_values.argmax(axis=1)
+
+        # Different blocks: suffix of lo's block, whole blocks in between, prefix of hi's block
+        apart = np.flatnonzero(lo_block < hi_block)
+        if len(apart):
+            best = self.suffix[lo[apart]]
+            first, last = lo_block[apart] + 1, hi_block[apart] - 1
+            between = np.flatnonzero(first <= last)
+            if len(between):
+                first, last = first[between], last[between]
+                level = np.floor(np.log2(last - first + 1)).astype(np.int64)
+                middle = np.empty(len(between), dtype=np.int64)
+                for k in np.unique(level).tolist():
+                    at = np.flatnonzero(level == k)
+                    middle[at] = self._first_highest(self.table[k][first[at]], self.table[k][last[at] - (1 << k) + 1])
+                best[between] = self._first_highest(best[between], middle)
+            result[apart] = self._first_highest(best, self.prefix[hi[apart]])
+
+        return int(result[0]) if scalar else result
+
+    def max(self, lo, hi):
+        return self.values[self.argmax(lo, hi)]
+
 def find_local_minima(df, distance=1):
     # Find local minima
     low = df['low'].values
@@ -124,253 +228,457 @@ def find_local_minima(df, distance=1):
 
     return lows_arr
 
-def add_local_lows(df, reset_threshold=3):
+class LocalLows:
+    # Local lows stack of every row, stored as pointers into one shared buffer.
+    #   index, price  : buffer of local lows (row index of the low, low price)
+    #   start, length : row i's stack is index[start[i] : start[i] + length[i]]
+    # A stack only changes at its top, so consecutive rows point at the same slice of the buffer.
+    # A slice is copied to the end of the buffer only when pops make it diverge from the rows that still use it.
+    __slots__ = ('index', 'price', 'start', 'length')
+
+    def __init__(self, index, price, start, length):
+        self.index = index
+        self.price = price
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return len(self.start)
+
+    def row(self, i):
+        # Returns (indices, prices) of the local lows at row i as views into the buffer
+        start = self.start[i]
+        end = start + self.length[i]
+        return self.index[start:end], self.price[start:end]
+
+    def to_strings(self, low_column):
+        # Legacy "index, price;index, price" representation of every row's stack.
+        # Prices are formatted from 'low_column' so they read exactly like the source data.
+        low_values = low_column.tolist()
+        labels = [f"{i}, {low_values[i]}" for i in self.index.tolist()]
+        return self.join(labels, ';', '')
+
+    def join(self, labels, separator, empty):
+        # One string per row, joining the labels (one per buffer position) of the row's stack.
+        # Rows with an empty stack get 'empty'. Consecutive rows sharing a stack share its string.
+        strings = []
+        last_pointer, last_string = None, empty
+        for pointer in zip(self.start.tolist(), self.length.tolist()):
+            if pointer != last_pointer:
+                start, length = pointer
+                last_pointer = pointer
+                last_string = separator.join(labels[start:start + length]) if length > 0 else empty
+            strings.append(last_string)
+        return strings
+
+def compute_local_lows(df, reset_threshold=3):
     # If a new lower minima is found, pop any existing higher lows and add the new low. 
     # If the new low is lower than 'reset_threshold' number of previous lows, local_lows is cleared.
-    local_lows = []
-    local_lows_column = [] # A list to store the cumulative local lows for each row.
-    for i, row in df.iterrows():
-        local_minima = row['local_minima']
-        low = row['low']
-        if local_minima == 1:
-            if not local_lows:
-                local_lows.append(f"{i}, {low}")
-            else:
-                last_local_low = float(local_lows[-1].split(',')[1])
-                if low > last_local_low:
-                    local_lows.append(f"{i}, {low}")
-                elif low < last_local_low:
-                    tmp = local_lows.copy()
-                    count_lower_low = 0
-                    for j in range(len(local_lows)-1, -1, -1):
-                        index, existing_low = tmp[j].split(',')
-                        existing_low = float(existing_low)
-                        if existing_low > low:
-                            tmp.pop()
-                            count_lower_low += 1
-                        else:
-                            break
-                    if count_lower_low >= reset_threshold:
-                        tmp.clear()
-                    local_lows = tmp
-                    local_lows.append(f"{i}, {low}")
-        local_lows_column.append(';'.join(local_lows))
-    df['local_lows'] = local_lows_column
+    # Only rows flagged in 'local_minima' can change the stack, every other row shares the previous row's stack.
+    low = df['low'].to_numpy(dtype=float)
+    event_rows = np.flatnonzero(df['local_minima'].to_numpy() == 1)
+    buffer = kernels.local_lows_buffer if kernels.use_numba() else local_lows_buffer
+    buffer_index, buffer_price, event_start, event_length = buffer(event_rows.astype(np.int64), low[event_rows], reset_threshold)
+
+    # Rows between two events keep the stack of the previous event
+    event_position = np.searchsorted(event_rows, np.arange(len(df)), side='right') - 1
+    has_stack = event_position >= 0
+    row_start = np.zeros(len(df), dtype=np.int64)
+    row_length = np.zeros(len(df), dtype=np.int64)
+    row_start[has_stack] = event_start[event_position[has_stack]]
+    row_length[has_stack] = event_length[event_position[has_stack]]
+
+    return LocalLows(buffer_index, buffer_price, row_start, row_length)
+
+def local_lows_buffer(event_rows, event_low, reset_threshold):
+    # The stack after every local minimum ('event_rows' with their 'event_low' prices), one stack after another in one buffer.
+    # Returns (buffer_index, buffer_price, event_start, event_length), the stack of event e is buffer[event_start[e]:][:event_length[e]]
+    event_start = np.zeros(len(event_rows), dtype=np.int64)
+    event_length = np.zeros(len(event_rows), dtype=np.int64)
+    buffer_index, buffer_price = [], []
+    start, length = 0, 0
+    for e, (i, low_price) in enumerate(zip(event_rows.tolist(), event_low.tolist())):
+        if length == 0:
+            start = len(buffer_index)
+            buffer_index.append(i)
+            buffer_price.append(low_price)
+            length = 1
+        else:
+            last_local_low = buffer_price[start + length - 1]
+            if low_price > last_local_low:
+                # The current stack always sits at the end of the buffer, so it grows in place
+                buffer_index.append(i)
+                buffer_price.append(low_price)
+                length += 1
+            elif low_price < last_local_low:
+                kept = length
+                while kept > 0 and buffer_price[start + kept - 1] > low_price:
+                    kept -= 1
+                if length - kept >= reset_threshold:
+                    kept = 0
+                new_start = len(buffer_index)
+                buffer_index.extend(buffer_index[start:start + kept])
+                buffer_price.extend(buffer_price[start:start + kept])
+                buffer_index.append(i)
+                buffer_price.append(low_price)
+                start, length = new_start, kept + 1
+        event_start[e] = start
+        event_length[e] = length
+
+    return np.array(buffer_index, dtype=np.int64), np.array(buffer_price, dtype=float), event_start, event_length
+
+def parse_local_lows(df):
+    # Rebuild LocalLows from the legacy 'local_lows' string column (e.g. a processed CSV read back from disk)
+    buffer_index, buffer_price = [], []
+    row_start = np.zeros(len(df), dtype=np.int64)
+    row_length = np.zeros(len(df), dtype=np.int64)
+    last_string, start, length = None, 0, 0
+    for i, local_lows in enumerate(df['local_lows'].fillna('').tolist()):
+        if local_lows != last_string:
+            last_string = local_lows
+            start = len(buffer_index)
+            lows = [low.split(',') for low in local_lows.split(';') if low]
+            buffer_index.extend(int(index) for index, price in lows)
+            buffer_price.extend(float(price) for index, price in lows)
+            length = len(lows)
+        row_start[i] = start
+        row_length[i] = length
+
+    return LocalLows(np.array(buffer_index, dtype=np.int64), np.array(buffer_price, dtype=float), row_start, row_length)
+
+def add_local_lows(df, reset_threshold=3, local_lows=None):
+    # Export every row's local lows as the legacy "index, price;index, price" column.
+    # The working representation is the LocalLows returned by compute_local_lows(), pass it to avoid recomputing.
+    if local_lows is None:
+        local_lows = compute_local_lows(df, reset_threshold)
+    df['local_lows'] = local_lows.to_strings(df['low'])
     
     return df
 
-def convert_local_lows_to_dates(df):
+def date_strings(dates):
+    # str() of every date, as pandas prints a Timestamp (e.g. '2022-01-01 00:00:00')
+    # Whole second datetimes are formatted in one NumPy call, anything else falls back to str()
+    values = np.asarray(dates)
+    if len(values) == 0:
+        # np.char.replace fails on zero-size arrays, e.g. the dates of a file without waves
+        return np.empty(0, dtype=str)
+    if values.dtype.kind == 'M':
+        seconds = values.astype('datetime64[s]')
+        if (seconds == values).all():
+            return np.char.replace(np.datetime_as_string(seconds, unit='s'), 'T', ' ')
+    return np.array([str(date) for date in pd.Series(dates, dtype=object)], dtype=str)
+
+def convert_local_lows_to_dates(df, local_lows=None):
     # Convert local_lows to dates
-    converted_dates = [None] * len(df)
-    for i, row in df.iterrows():
-        local_lows = row['local_lows']
-        if local_lows:
-            local_lows_index = extract_each_row_local_lows_highs(row, True, False, True)
-            dates = []
-            for each_index in local_lows_index:
-                dates.append(str(df.loc[each_index, 'date']))
-            converted_dates[i] = '; '.join(dates)
-    df['local_lows_converted'] = converted_dates
+    # Only needed for the processed CSV, so it runs at export time: the dates of the whole LocalLows buffer
+    # are gathered at once, then joined per stack like the 'local_lows' strings.
+    if local_lows is None:
+        local_lows = parse_local_lows(df)
+    labels = date_strings(df['date'].to_numpy()[local_lows.index]).tolist()
+    df['local_lows_converted'] = local_lows.join(labels, '; ', None)
     
     return df
 
-def detect_waves(df):
+def detect_waves(df, local_lows=None):
     # Detect waves
     # A wave is detected if there are at least two local lows that increase in value in chronological order
-    df['wave_detected'] = 0
-    for i, row in df.iterrows():
-        local_lows = row['local_lows'].split(';')
-        if len(local_lows) > 1:
-            df.at[i, 'wave_detected'] = 1
+    if local_lows is None:
+        local_lows = parse_local_lows(df)
+    df['wave_detected'] = (local_lows.length > 1).astype(int)
     
     return df
 
-def store_unique_pairs_local_lows(df):
+# Wave candidates (low1, high1, low2) and resolved waves (+ high2, retracement point) flow through the pipeline
+# as NumPy structured arrays. The legacy "idx, price;idx, price" keys are only built by wave_keys() for exports.
+CANDIDATE_DTYPE = np.dtype([
+    ('low1_index', np.int64), ('low1_price', float),
+    ('high1_index', np.int64), ('high1_price', float),
+    ('low2_index', np.int64), ('low2_price', float),
+])
+WAVE_DTYPE = np.dtype(CANDIDATE_DTYPE.descr + [
+    ('high2_index', np.int64), ('high2_price', float),
+    ('retracement_index', np.int64), ('retracement_price', float),
+])
+WAVE_POINTS = ['low1', 'high1', 'low2', 'high2', 'retracement']
+
+def wave_keys(waves):
+    # Legacy keys of candidates or waves, e.g. '315, 17232.35;323, 17996.33'
+    return [f"{low1_index}, {low1_price};{low2_index}, {low2_price}" for low1_index, low1_price, low2_index, low2_price in zip(
+        waves['low1_index'].tolist(), waves['low1_price'].tolist(), waves['low2_index'].tolist(), waves['low2_price'].tolist()
+    )]
+
+def wave_points(waves, point):
+    # (indices, prices) of one of the WAVE_POINTS of every wave
+    return waves[f"{point}_index"], waves[f"{point}_price"]
+
+def waves_to_dict(waves):
+    # Legacy dictionary of waves: {key: [[low1_index, low1_price], [high1_index, high1_price], ..., [retracement_index, retracement_price]]}
+    points = [list(zip(*(column.tolist() for column in wave_points(waves, point)))) for point in WAVE_POINTS]
+    return {key: [list(point) for point in wave] for key, wave in zip(wave_keys(waves), zip(*points))}
+
+def store_unique_pairs_local_lows(df, local_lows=None, local_highs=None):
     # Store unique pairs of local lows
-    # Returns a dictionary: 
-    #   key : unique local lows as keys
-    #   value : [highest price's index for low1's index + 1 : low2's index - 1,
-    #           highest price between low1's index + 1 : low2's index - 1]
-    unique_pairs_local_lows = {}
-    for i, row in df.iterrows():
-        wave_detected = row['wave_detected']
-        if wave_detected == 1:
-            local_lows_index = extract_each_row_local_lows_highs(row, True, False, True)    # [3, 5, 7]
-            local_lows_price = extract_each_row_local_lows_highs(row, True, False, False)   # [300, 400, 600]
-            local_highs_index = extract_each_row_local_lows_highs(row, False, True, True)    
-            local_highs_price = extract_each_row_local_lows_highs(row, False, True, False)
-            local_lows = list(zip(local_lows_index, local_lows_price))
-            local_highs = list(zip(local_highs_index, local_highs_price))
-            for i in range(1, len(local_lows)):
-                prev_index, prev_price = local_lows[i-1]
-                cur_index, cur_price = local_lows[i]
-                high1_index, high1_price = local_highs[i-1]
-                each_pair = f"{prev_index}, {prev_price};{cur_index}, {cur_price}"
-                if each_pair not in unique_pairs_local_lows:
-                    unique_pairs_local_lows[each_pair] = [high1_index, high1_price]
+    # Returns a CANDIDATE_DTYPE array, one record per unique (low1, low2) pair in the order they first appear, with
+    #   high1 : highest price (and its index) between low1's index + 1 : low2's index - 1
+    if local_lows is None:
+        local_lows = parse_local_lows(df)
+    if local_highs is None:
+        local_highs = compute_local_highs(local_lows, RangeMax(df['high']))
+    #
+    # A slice of the buffer is only used by consecutive rows and only grows in place (see compute_local_lows),
+    # so every buffer position is listed once, by the first row whose stack reaches it: the cost follows the buffer
+    # and not rows x stack depth. Positions come out in (row, position) order, the order of the original row by row loop,
+    # and pairs are deduplicated on a 1D (low1, low2) key keeping their first occurrence.
+    rows = np.flatnonzero(df['wave_detected'].to_numpy() == 1)
+    starts, lengths = local_lows.start[rows], local_lows.length[rows]
+    changed = np.r_[True, (starts[1:] != starts[:-1]) | (lengths[1:] != lengths[:-1])][:len(rows)]
+    starts, lengths = starts[changed], lengths[changed]
+
+    # Each stack covers the positions from the previous stack's length on the same slice up to its own length,
+    # a new slice starts at 1 as the bottom of the stack is never low2
+    same_slice = np.r_[False, starts[1:] == starts[:-1]][:len(starts)]
+    covered = np.where(same_slice, np.r_[1, lengths[:-1]], 1)
+    new = np.maximum(lengths - covered, 0)
+    positions = np.repeat(starts + covered - (np.cumsum(new) - new), new) + np.arange(new.sum())
+
+    key = local_lows.index[positions - 1] * (len(df) + 1) + local_lows.index[positions]
+    _, first_occurrence = np.unique(key, return_index=True)
+    pair_positions = positions[np.sort(first_occurrence)]
+    unique_pairs_local_lows = np.empty(len(pair_positions), dtype=CANDIDATE_DTYPE)
+    unique_pairs_local_lows['low1_index'] = local_lows.index[pair_positions - 1]
+    unique_pairs_local_lows['low1_price'] = local_lows.price[pair_positions - 1]
+    unique_pairs_local_lows['high1_index'] = local_highs[0][pair_positions]
+    unique_pairs_local_lows['high1_price'] = local_highs[1][pair_positions]
+    unique_pairs_local_lows['low2_index'] = local_lows.index[pair_positions]
+    unique_pairs_local_lows['low2_price'] = local_lows.price[pair_positions]
+
     return unique_pairs_local_lows
 
 def store_unique_pairs_local_lows_within_fib_levels(unique_pairs_local_lows, retracement_ratio=0.618):
-    # Takes a dictionary from 'store_unique_pairs_local_lows'
-    # Returns dictionary with low2 being within fib levels of (high1 - low1)
-    unique_pairs_local_lows_within_fib_levels = copy.deepcopy(unique_pairs_local_lows)
-    result = {}
-    for lows, (high1_index, high1_price) in unique_pairs_local_lows_within_fib_levels.items():
-        # '315, 17232.35;323, 17996.33'
-        low1, low2 = lows.split(";")
-        # ['315, 17232.35', '323, 17996.33']
-        low1_index, low1_price = low1.split(',')
-        low1_index = int(low1_index)
-        low1_price = float(low1_price)        
-        low2_index, low2_price = low2.split(',')
-        low2_index = int(low2_index)
-        low2_price = float(low2_price)
-
-        fib_level = high1_price - (high1_price - low1_price) * retracement_ratio
-        if low1_price < low2_price <= fib_level:
-            result[lows] = [low1_index, low1_price, high1_index, high1_price, low2_index, low2_price]
+    # Takes candidates from 'store_unique_pairs_local_lows'
+    # Returns the candidates with low2 being within fib levels of (high1 - low1)
+    low1_price = unique_pairs_local_lows['low1_price']
+    high1_price = unique_pairs_local_lows['high1_price']
+    low2_price = unique_pairs_local_lows['low2_price']
+    fib_level = high1_price - (high1_price - low1_price) * retracement_ratio
             
-    return result
+    return unique_pairs_local_lows[(low1_price < low2_price) & (low2_price <= fib_level)]
+
+def find_breakouts(high, low, start, low1_price, high1_price):
+    # First row, from 'start' onwards, where each candidate either falls below low1 or exceeds high1.
+    # One forward pass over the candles, open candidates wait in two price-keyed heaps:
+    #   falls_below : max-heap of low1 prices, a candle's low pops every candidate with low1 >= low
+    #   exceeds     : min-heap of high1 prices, a candle's high pops every candidate with high1 < high
+    # Falling below low1 is checked first, so a candle doing both counts as a failure.
+    # Returns (breakout_index, exceeded): breakout_index is -1 if neither happened before the last row.
+    # With the 'numba' backend (see kernels.py) the compiled kernel runs instead.
+    if kernels.use_numba():
+        return kernels.find_breakouts(
+            np.ascontiguousarray(high, dtype=float), np.ascontiguousarray(low, dtype=float), np.ascontiguousarray(start, dtype=np.int64),
+            np.ascontiguousarray(low1_price, dtype=float), np.ascontiguousarray(high1_price, dtype=float)
+        )
+    n = len(high)
+    breakout_index = np.full(len(start), -1, dtype=np.int64)
+    exceeded = np.zeros(len(start), dtype=bool)
+    order = [c for c in np.argsort(start, kind='stable').tolist() if start[c] < n]
+    high, low, start = high.tolist(), low.tolist(), start.tolist()
+    low1_price, high1_price = low1_price.tolist(), high1_price.tolist()
+    resolved = [False] * len(start)
+    falls_below, exceeds = [], []
+    k = 0
+    i = start[order[0]] if order else n
+    while i < n:
+        while k < len(order) and start[order[k]] == i:
+            c = order[k]
+            heapq.heappush(falls_below, (-low1_price[c], c))
+            heapq.heappush(exceeds, (high1_price[c], c))
+            k += 1
+        while falls_below and -falls_below[0][0] >= low[i]:
+            c = heapq.heappop(falls_below)[1]
+            if not resolved[c]:
+                resolved[c] = True
+                breakout_index[c] = i
+        while exceeds and exceeds[0][0] < high[i]:
+            c = heapq.heappop(exceeds)[1]
+            if not resolved[c]:
+                resolved[c] = True
+                breakout_index[c] = i
+                exceeded[c] = True
+        # Skip ahead to the next candidate when nothing is open
+        if len(falls_below) == 0 and k < len(order):
+            i = max(i + 1, start[order[k]])
+        elif len(falls_below) == 0:
+            break
+        else:
+            i += 1
+
+    return breakout_index, exceeded
+
+def find_retracements(high, low, exceeded_index, low2_price, high2_retracement_ratio=0.382):
+    # For candidates whose high exceeded high1 at 'exceeded_index', find the row where price retraces
+    # to the Fibonacci level of (low2, running max), starting the candle after the one that exceeded high1.
+    # high2_retracement_ratio indicates retracement amount.
+    # For example, if max is 2000, bottom is 1800, and high2_retracement_ratio is 0.382, 
+    # it calculates to 2000 - ((2000 - 1800) * 0.382) = 1923.6.
+    #
+    # Candidates share their running max once a higher high arrives, so they are kept in groups with one max each.
+    # The groups form a stack (older groups have higher maxes) and a new high merges every group below it.
+    # Within a group the Fibonacci level only depends on low2, so each group is a heap keyed by low2,
+    # and one global heap holds every group's best level. A candle's low pops every level >= low.
+    # On the last row every open candidate is recorded as it is, like the original per-candidate loop.
+    # Returns (exit_index, high2_end): the retracement row and the last row to search high2 in.
+    # With the 'numba' backend (see kernels.py) the compiled kernel runs instead.
+    if kernels.use_numba():
+        return kernels.find_retracements(
+            np.ascontiguousarray(high, dtype=float), np.ascontiguousarray(low, dtype=float), np.ascontiguousarray(exceeded_index, dtype=np.int64),
+            np.ascontiguousarray(low2_price, dtype=float), float(high2_retracement_ratio)
+        )
+    n = len(high)
+    exit_index = np.full(len(exceeded_index), n - 1, dtype=np.int64)
+    high2_end = np.full(len(exceeded_index), n - 1, dtype=np.int64)
+    ratio = high2_retracement_ratio
+    # fib_level grows with low2 when ratio >= 0 and shrinks otherwise
+    sign = 1 if ratio >= 0 else -1
+    order = [c for c in np.argsort(exceeded_index, kind='stable').tolist() if exceeded_index[c] < n - 1]
+    high, low = high.tolist(), low.tolist()
+    exceeded_index, low2_price = exceeded_index.tolist(), low2_price.tolist()
+
+    group_max, group_members, group_version = [], [], []
+    stack, levels = [], []
+
+    def fib_level(cur_max, c):
+        return cur_max - ((cur_max - low2_price[c]) * ratio)
+
+    def push_level(g):
+        group_version[g] += 1
+        if group_members[g]:
+            heapq.heappush(levels, (-fib_level(group_max[g], group_members[g][0][1]), g, group_version[g]))
+
+    def retrace(c, i):
+        exit_index[c] = i
+        high2_end[c] = i - 1
 
-def search_high2(df, unique_pairs_local_lows_within_fib_levels, high2_retracement_ratio=0.382, debugging=False):
-    # Takes a dictionary from 'store_unique_pairs_local_lows_within_fib_levels'
+    k = 0
+    i = exceeded_index[order[0]] if order else n
+    while i < n - 1:
+        cur_high, cur_low = high[i], low[i]
+        # A higher high becomes the running max of every group below it.
+        # Levels of the merged groups are checked with the new max before they merge.
+        merged = None
+        while stack and group_max[stack[-1]] < cur_high:
+            g = stack.pop()
+            members = group_members[g]
+            while members and fib_level(cur_high, members[0][1]) >= cur_low:
+                retrace(heapq.heappop(members)[1], i)
+            group_version[g] += 1
+            if merged is None:
+                merged = g
+                continue
+            # Merge the smaller heap into the larger one
+            if len(members) > len(group_members[merged]):
+                merged, members = g, group_members[merged]
+            for member in members:
+                heapq.heappush(group_members[merged], member)
+        if merged is not None:
+            group_max[merged] = cur_high
+            stack.append(merged)
+            push_level(merged)
+
+        while levels and -levels[0][0] >= cur_low:
+            _, g, version = heapq.heappop(levels)
+            if version != group_version[g]:
+                continue
+            retrace(heapq.heappop(group_members[g])[1], i)
+            push_level(g)
+
+        # Candidates exceeding high1 on this candle start being checked on the next one
+        while k < len(order) and exceeded_index[order[k]] == i:
+            c = order[k]
+            if stack and group_max[stack[-1]] == cur_high:
+                g = stack[-1]
+            else:
+                g = len(group_max)
+                group_max.append(cur_high)
+                group_members.append([])
+                group_version.append(0)
+                stack.append(g)
+            heapq.heappush(group_members[g], (-sign * low2_price[c], c))
+            push_level(g)
+            k += 1
+        i += 1
+
+    return exit_index, high2_end
+
+def search_high2(df, unique_pairs_local_lows_within_fib_levels, high2_retracement_ratio=0.382, debugging=False, range_max=None, breakouts=None, verbose=True):
+    # Takes candidates from 'store_unique_pairs_local_lows_within_fib_levels'
     # Search for high2 price for each pair of local lows
+    # 'range_max' is the RangeMax of df['high'], pass it to share the one built for add_local_highs
+    # 'breakouts' is find_breakouts()'s result for these candidates. It does not depend on high2_retracement_ratio,
+    # so sweep() computes it once and passes it for every ratio.
+    #
+    # Searching starts from low2_index + 2 to avoid look-ahead bias.
+    #   Failure : price falls below low1 before exceeding high1.
+    #             high2 is the highest high between low2_index + 2 and the previous candle,
+    #             or the open price (conservatively) if it falls below on low2_index + 2 itself.
+    #   Success : price exceeds high1, then retraces to the Fibonacci level of (low2, running max),
+    #             or the file ends. high2 is the highest high before the retracement candle.
+    # All candidates are resolved together by find_breakouts() and find_retracements().
+    # Returns two WAVE_DTYPE arrays (success waves, failure waves) in candidate order.
     # 
     # uncounted_waves includes two types waves: 
     #   1. When immediate_candle_after_low2 (candle at low2_index + 1)'s high exceeds high 1
     #   2. When neither of success condition nor failure conditions are met. 
     #      i.e current price in the range of (low1_price, high1_price)
-    unique_waves_success = {}
-    unique_waves_failure = {}
-    for lows, (low1_index, low1_price, high1_index, high1_price, low2_index, low2_price) in unique_pairs_local_lows_within_fib_levels.items():
-        cur_max = 0
-        cur_min = float('inf')
-        high2_exceeded_high1_before = False
-        
-        immediate_candle_after_low2 = df.iloc[low2_index + 1]
-        if immediate_candle_after_low2['high'] > high1_price:
-            continue
-        
-        for i, row in df.iloc[low2_index+2:].iterrows():    # 'low2_index+2' to avoid look-ahead bias
-            cur_high = row['high']
-            cur_low = row['low']
-            cur_max = max(cur_max, cur_high)
-            cur_min = min(cur_min, cur_low)
-            if debugging:
-                print(f"row : {i} / {lows} is being processed / {(low1_index, low1_price, high1_index, high1_price, low2_index, low2_price)} / cur_max:{cur_max} / cur_min:{cur_min} / cur_high:{cur_high} / cur_low:{cur_low}")
-            
-            # Failure case
-            if cur_min <= low1_price and not high2_exceeded_high1_before:   # if high2 exceeded high1 already, it is not a failure case
-                point_falls_below_low1_index, point_falls_below_low1_price = i, cur_low
-                # when current candle falls below at low2_index + 2
-                if i == low2_index + 2:
-                    if debugging:
-                        print(f"\tcur min {cur_min} falls below low1_price {low1_price}, Find between (low2_index+2: {low2_index+2}, current row: {i})")
-                    high2_index = i
-                    high2_price = df.loc[i]['open'] # set high2_price at current open price, conservatively.
-                    unique_waves_failure[lows] = [[low1_index, low1_price], [high1_index, high1_price], [low2_index, low2_price], [high2_index, high2_price], [point_falls_below_low1_index, point_falls_below_low1_price]]
-                # when current candle falls below after low2_index + 2
-                else:
-                    if debugging:
-                        print(f"\tcur min {cur_min} falls below low1_price {low1_price}, Find high2 between (low2_index+2: {low2_index+2}, current row - 1: {i-1})")
-                    high2_index = df.loc[low2_index+2 : i-1,'high'].idxmax()
-                    high2_price = df.loc[low2_index+2 : i-1,'high'].max()
-                    unique_waves_failure[lows] = [[low1_index, low1_price], [high1_index, high1_price], [low2_index, low2_price], [high2_index, high2_price], [point_falls_below_low1_index, point_falls_below_low1_price]]
-                if debugging:
-                    print("\tAppended to failure_waves")
-                break
-
-            # Success case
-            if cur_max > high1_price:
-                if debugging:
-                    print(f"\tcur_max {cur_max} exceeds high1_price of {high1_price}")
-                # If it is the last row, record it in success_waves
-                if i == df.index[-1]:
-                    point_falls_below_retracement_ratio_index, point_falls_below_retracement_ratio_price = i, cur_low
-                    if debugging:
-                        print(f"\tAfter cur_max {cur_max} exceeded high1_price of {high1_price}, since it is the last row of the file -> appended to success_waves")
-                    high2_index = df.loc[low2_index+2 : i,'high'].idxmax()
-                    high2_price = df.loc[low2_index+2 : i,'high'].max()
-                    unique_waves_success[lows] = [[low1_index, low1_price], [high1_index, high1_price], [low2_index, low2_price], [high2_index, high2_price], [point_falls_below_retracement_ratio_index, point_falls_below_retracement_ratio_price]]
-                    break
-                # If high2 didn't exceed high1 before, go to the next candle
-                if not high2_exceeded_high1_before:
-                    high2_exceeded_high1_before = True
-                    if debugging:
-                        print(f"\tGo to next row")
-                    continue
-
-                # Find the point where high1 retraces equal to or more than Fibonacci retracement ratio
-                # high2_retracement_ratio indicates retracement amount.
-                # For example, if max is 2000, bottom is 1800, and high2_retracement_ratio is 0.382, 
-                # it calculates to 2000 - ((2000 - 1800) * 0.382) = 1923.6.
-                fib_level = cur_max - ((cur_max - low2_price) * high2_retracement_ratio)
-                
-                if debugging:
-                    print(f"\tfib_level of {high2_retracement_ratio}: {fib_level}")
-                if cur_low <= fib_level:
-                    if debugging:
-                        print(f"\tcur_low {cur_low} is less than fib_level of {fib_level} -> appended to success_waves")
-                    point_falls_below_retracement_ratio_index, point_falls_below_retracement_ratio_price = i, cur_low
-                    high2_index = df.loc[low2_index+2 : i-1,'high'].idxmax()
-                    high2_price = df.loc[low2_index+2 : i-1,'high'].max()
-                    unique_waves_success[lows] = [[low1_index, low1_price], [high1_index, high1_price], [low2_index, low2_price], [high2_index, high2_price], [point_falls_below_retracement_ratio_index, point_falls_below_retracement_ratio_price]]
-                    break
-                if debugging:
-                    print(f"\tcur_low {cur_low} is still higher than fib_level of {fib_level}")
-                continue
-    
-    uncounted_waves = {}
-    for k,v in unique_pairs_local_lows_within_fib_levels.items():
-        if k not in {**unique_waves_success, **unique_waves_failure}:
-            low1, low2 = k.split(';')
-            low1 = df.loc[int(low1.split(',')[0])]['date']
-            low2 = df.loc[int(low2.split(',')[0])]['date']
-            uncounted_waves[k] = f"{low1} ; {low2}"
-    print(f"search_high2: Out of {len(unique_pairs_local_lows_within_fib_levels)} wave candidates, there were {len(unique_waves_success)} success waves, {len(unique_waves_failure)} failure waves, {len(uncounted_waves)} uncounted waves.")
+    if range_max is None:
+        range_max = RangeMax(df['high'])
+    open, high, low = df['open'].to_numpy(dtype=float), df['high'].to_numpy(dtype=float), df['low'].to_numpy(dtype=float)
+    candidates = unique_pairs_local_lows_within_fib_levels
+    low1_price, high1_price, low2_price = candidates['low1_price'], candidates['high1_price'], candidates['low2_price']
+    low2_index = candidates['low2_index']
+    start = low2_index + 2      # 'low2_index+2' to avoid look-ahead bias
+
+    if breakouts is None:
+        breakouts = find_breakouts(high, low, start, low1_price, high1_price)
+    breakout_index, exceeded = breakouts
+    # Waves whose immediate candle after low2 already exceeds high1 are not counted
+    counted = high[low2_index + 1] <= high1_price
+    failure = counted & (breakout_index >= 0) & ~exceeded
+    success = counted & exceeded
+    retracement_index = breakout_index.copy()
+    high2_end = breakout_index - 1
+    retracement_index[success], high2_end[success] = find_retracements(high, low, breakout_index[success], low2_price[success], high2_retracement_ratio)
+
+    resolved = np.flatnonzero(failure | success)
+    waves = np.empty(len(resolved), dtype=WAVE_DTYPE)
+    for field in CANDIDATE_DTYPE.names:
+        waves[field] = candidates[field][resolved]
+    waves['retracement_index'] = retracement_index[resolved]
+    waves['retracement_price'] = low[retracement_index[resolved]]
+    high2_index = range_max.argmax(start[resolved], high2_end[resolved])
+    # Falling below low1 on low2_index + 2 itself: set high2_price at current open price, conservatively.
+    at_open = high2_index < 0
+    waves['high2_index'] = np.where(at_open, waves['retracement_index'], high2_index)
+    waves['high2_price'] = np.where(at_open, open[waves['retracement_index']], high[waves['high2_index']])
+    is_success = success[resolved]
+    if debugging:
+        for key, wave, wave_success in zip(wave_keys(waves), waves.tolist(), is_success.tolist()):
+            print(f"{key} / {'success' if wave_success else 'failure'} / {wave}")
+
+    unique_waves_success, unique_waves_failure = waves[is_success], waves[~is_success]
+    uncounted_waves = len(candidates) - len(waves)
+    if verbose:
+        print(f"search_high2: Out of {len(candidates)} wave candidates, there were {len(unique_waves_success)} success waves, {len(unique_waves_failure)} failure waves, {uncounted_waves} uncounted waves.")
     return unique_waves_success, unique_waves_failure
 
 def save_combined_waves_df(df, combined_waves, filename, save_df=False):
     # Save the result to a DataFrame
     
     # The parameter combined_waves should be constructed from the return values of the search_high2() function.
-    # The search_high2() function returns two dictionaries: unique_waves_success and unique_waves_failure.
-    # The combined_waves variable can be created by merging these two dictionaries like this:
-    # combined_waves = {**unique_waves_success, **unique_waves_failure}
+    # The search_high2() function returns two WAVE_DTYPE arrays: unique_waves_success and unique_waves_failure.
+    # The combined_waves variable can be created by concatenating these two arrays like this:
+    # combined_waves = np.concatenate([unique_waves_success, unique_waves_failure])
     # Alternatively, combined_waves can be set to either unique_waves_success or unique_waves_failure individually.
-    combined_lows = {}
-    for lows, points in combined_waves.items():
-        low1_index, low1_price = points[0]
-        high1_index, high1_price = points[1]
-        low2_index, low2_price = points[2]
-        high2_index, high2_price = points[3]
-        retracement_index, retracement_price = points[4]
-        date = str(df.iloc[low1_index]['date']) + '; '\
-                + str(df.iloc[high1_index]['date']) + '; '\
-                + str(df.iloc[low2_index]['date']) + '; '\
-                + str(df.iloc[high2_index]['date']) + '; '\
-                + str(df.iloc[retracement_index]['date'])
-        
-        # Hypothesis testing
-        diff = float(high2_price - high1_price)
-        
-        # Strategy 1
-        s1_entry = float(df.iloc[low2_index + 2]['open'])
-        s1_profit = retracement_price - s1_entry
-        s1_loss = low1_price - s1_entry
-
-        combined_lows[lows] = [ date, low1_price, high1_price, low2_price, high2_price, retracement_price, diff, \
-                                s1_entry, s1_profit, s1_loss
-        ]
-
-    # Convert the dictionary to a DataFrame
-    result_df = pd.DataFrame.from_dict(
-        combined_lows, 
-        orient='index',  
-        columns=['dates(low1; high1; low2; high2; threshold_hit)', 'low1', 'high1', 'low2', 'high2', 'threshold', 'wave3_max - wave1_max', \
-                 's1_entry', 's1_profit', 's1_loss'
-        ]
-    )
+    result_df = build_result_df(df, combined_waves)
     
     # Save to CSV if requested
     if save_df:
@@ -378,42 +686,105 @@ def save_combined_waves_df(df, combined_waves, filename, save_df=False):
     
     return combined_waves
 
-def add_local_highs(df):
+def build_result_df(df, combined_waves, dates=None, s1_entry=None):
+    # One row per wave with its dates, prices, the hypothesis test difference and Strategy 1 values.
+    # Rows are indexed by the legacy "idx, price;idx, price" keys.
+    # 'dates' (one list of date strings per WAVE_POINTS) and 's1_entry' can be given instead of being looked up in 'df',
+    # for waves whose frame is not in memory (see streaming.detect_chunked), 'df' is not used then.
+    if dates is None:
+        date_values = df['date'].to_numpy()
+        dates = [date_strings(date_values[combined_waves[f"{point}_index"]]).tolist() for point in WAVE_POINTS]
+    
+    # Hypothesis testing
+    diff = combined_waves['high2_price'] - combined_waves['high1_price']
+    
+    # Strategy 1
+    if s1_entry is None:
+        s1_entry = df['open'].to_numpy(dtype=float)[combined_waves['low2_index'] + 2]
+    s1_profit = combined_waves['retracement_price'] - s1_entry
+    s1_loss = combined_waves['low1_price'] - s1_entry
+
+    result_df = pd.DataFrame({
+        'dates(low1; high1; low2; high2; threshold_hit)': ['; '.join(wave_dates) for wave_dates in zip(*dates)],
+        'low1': combined_waves['low1_price'],
+        'high1': combined_waves['high1_price'],
+        'low2': combined_waves['low2_price'],
+        'high2': combined_waves['high2_price'],
+        'threshold': combined_waves['retracement_price'],
+        'wave3_max - wave1_max': diff,
+        's1_entry': s1_entry,
+        's1_profit': s1_profit,
+        's1_loss': s1_loss,
+    }, index=wave_keys(combined_waves))
+
+    return result_df
+
+def compute_local_highs(local_lows, range_max):
     # Find local highs between two local lows
-    local_highs = [None] * len(df)
-    for i, row in df.iterrows():
-        wave_detected = row['wave_detected']
-        if wave_detected == 1: # local_lows at least have two lows
-            local_lows = row['local_lows'].split(';')
-            high_values = []
-            for j in range(1, len(local_lows)):
-                prev_index, prev_price = local_lows[j-1].split(',')
-                cur_index, cur_price = local_lows[j].split(',')
-                
-                # find highest high 
-                highest_high_index = df.loc[int(prev_index)+1:int(cur_index)-1, 'high'].idxmax()
-                highest_high_price = df.loc[int(prev_index)+1:int(cur_index)-1, 'high'].max()
-                high_values.append(f"{highest_high_index}, {highest_high_price}")
-            local_highs[i] = '; '.join(high_values)
-    df['local_highs'] = local_highs
+    # Returns (high_index, high_price) aligned with the LocalLows buffer:
+    #   position j holds the highest high strictly between the lows at buffer positions j-1 and j,
+    #   or (-1, nan) when j is the bottom of a stack.
+    # Each distinct (low1, low2) range is queried once, however many rows or copied stacks share it.
+    high_index = np.full(len(local_lows.index), -1, dtype=np.int64)
+    high_price = np.full(len(local_lows.index), np.nan)
+    stack_bottom = np.zeros(len(local_lows.index), dtype=bool)
+    stack_bottom[local_lows.start[local_lows.length > 0]] = True
+    positions = np.flatnonzero(~stack_bottom)
+    if len(positions):
+        lo, hi = local_lows.index[positions - 1] + 1, local_lows.index[positions] - 1
+        # One 1D key per range, np.unique on it is much faster than on (lo, hi) rows
+        _, first, inverse = np.unique(lo * (len(range_max.values) + 1) + hi, return_index=True, return_inverse=True)
+        unique_high_index = range_max.argmax(lo[first], hi[first])
+        high_index[positions] = unique_high_index[inverse]
+        high_price[positions] = range_max.values[high_index[positions]]
+
+    return high_index, high_price
+
+def add_local_highs(df, local_lows=None, local_highs=None):
+    # Export the local highs between every row's local lows as the legacy "index, price; index, price" column.
+    # The working representation is the buffer returned by compute_local_highs(), pass it to avoid recomputing.
+    if local_lows is None:
+        local_lows = parse_local_lows(df)
+    if local_highs is None:
+        local_highs = compute_local_highs(local_lows, RangeMax(df['high']))
+    high_values = df['high'].tolist()
+    labels = [f"{j}, {high_values[j]}" if j >= 0 else None for j in local_highs[0].tolist()]
+    local_highs_column = [None] * len(df)
+    for i in np.flatnonzero(local_lows.length > 1).tolist(): # local_lows at least have two lows
+        start = int(local_lows.start[i])
+        local_highs_column[i] = '; '.join(labels[start + 1:start + int(local_lows.length[i])])
+    df['local_highs'] = local_highs_column
 
     return df
 
-def save_chart(df, filename, success_waves, failure_waves, plot_success_waves=True, plot_failure_waves=False):
-    # Prepare the data for mplfinance
-    candlestick_chart_df = df[['date', 'open', 'high', 'low', 'close']].copy()
-    candlestick_chart_df['Date'] = pd.to_datetime(candlestick_chart_df['date'])
-    candlestick_chart_df = candlestick_chart_df.set_index('Date', inplace=False)
-    candlestick_chart_df = candlestick_chart_df[['open', 'high', 'low', 'close']]  # Ensure the columns are in the correct order
+def candlestick_frame(df):
+    # Date indexed open/high/low/close frame for mplfinance
+    candlestick_chart_df = df[['open', 'high', 'low', 'close']].copy()  # Ensure the columns are in the correct order
+    candlestick_chart_df.index = pd.DatetimeIndex(pd.to_datetime(df['date']), name='Date')
+    return candlestick_chart_df
+
+def plot_waves(axes, waves, linestyle, offset=0):
+    # Plotting waves on top of candlestick chart axes, mplfinance puts candle i at x = i (minus the window's first row 'offset')
+    markers = ['o', 's', 'd', "*"]
+    for i, wave in enumerate(waves_to_dict(waves).values()):
+        x_coords = [point[0] - offset for point in wave]
+        y_coords = [point[1] for point in wave]
+        axes.plot(x_coords, y_coords, marker=markers[i % len(markers)], linestyle=linestyle, alpha=0.5)
+
+CHART_TITLE = "Bitcoin Hourly Price Movements with Detected Elliott Waves"
+
+def save_chart(df, filename, success_waves, failure_waves, plot_success_waves=True, plot_failure_waves=False, title=CHART_TITLE):
+    # Candlestick chart of the whole series with the detected waves, saved to 'filename'.
+    # Nothing is shown and the figure is closed once saved, so it runs headless and does not leak figures.
+    candlestick_chart_df = candlestick_frame(df)
 
     # Create a candlestick chart -> save picture, dataset(axes)
     first_date, last_date = candlestick_chart_df.index[0], candlestick_chart_df.index[-1]
     picture, dataset = mpf.plot(candlestick_chart_df, type='candle', style='charles', volume=False, figsize=(14,9), returnfig=True)
 
     # Set a title
-    date_range = f"Bitcoin Hourly Price Movements with Detected Elliott Waves\n\nDate: ({first_date} - {last_date})"
-    title = dataset[0].set_title(date_range, fontsize=16, pad=20)
-    # title.set_y(1.4)    # title y location
+    date_range = f"{title}\n\nDate: ({first_date} - {last_date})"
+    dataset[0].set_title(date_range, fontsize=16, pad=20)
     
     # Set margin space around the subplots -> Does not seem to work for some reason.
     picture.subplots_adjust(left=0.1, right=0.9, top=0.85, bottom=0.15)
@@ -422,35 +793,64 @@ def save_chart(df, filename, success_waves, failure_waves, plot_success_waves=Tr
     dataset[0].set_ylabel('')
 
     # Highlight detected waves
-    success_waves = list(success_waves.values())
-    failure_waves = list(failure_waves.values())
-    markers = ['o', 's', 'd', "*"]
     if plot_success_waves:
-        for i, wave in enumerate(success_waves):
-            x_coords = [point[0] for point in wave]
-            y_coords = [point[1] for point in wave]
-            marker_index = i % len(markers)
-            # plt.plot(df['date'].iloc[x_coords], y_coords, marker=markers[marker_index], linestyle='-', alpha=0.5)   # comment out when using mpf. This line plots waves with plt.
-            
-            # Plotting waves data on top of candlestick chart axes (dataset[0])
-            dataset[0].plot(x_coords, y_coords, marker=markers[marker_index], linestyle='-', alpha=0.5) # dataset[0] = candlestick chart data(axes)
+        plot_waves(dataset[0], success_waves, '-')
     if plot_failure_waves:
-        for i, wave in enumerate(failure_waves):
-            x_coords = [point[0] for point in wave]
-            y_coords = [point[1] for point in wave]
-            marker_index = i % len(markers)
-            # plt.plot(df['date'].iloc[x_coords], y_coords, marker=markers[marker_index], linestyle='-', alpha=0.5)   # comment out when using mpf. This line plots waves with plt.
-            
-            # Plotting waves data on top of candlestick chart axes (dataset[0])
-            dataset[0].plot(x_coords, y_coords, marker=markers[marker_index], linestyle=':', alpha=0.5) # dataset[0] = candlestick chart data(axes)
+        plot_waves(dataset[0], failure_waves, ':')
     
-    plt.show()
-    # picture.savefig(filename, bbox_inches='tight')
     picture.savefig(filename)
-    # plt.close()
+    plt.close(picture)
+
+def save_wave_charts(df, folder, success_waves, failure_waves, plot_success_waves=True, plot_failure_waves=False, title=CHART_TITLE, padding=24):
+    # One candlestick chart per wave, cropped to the wave (low1 -> retracement point) plus 'padding' candles on each side.
+    # Charts are saved to '{folder}/{success|failure}_{low1_index}_{low2_index}.jpg', returns their filenames.
+    os.makedirs(folder, exist_ok=True)
+    candlestick_chart_df = candlestick_frame(df)
+    filenames = []
+    for status, waves, plot, linestyle in (('success', success_waves, plot_success_waves, '-'), ('failure', failure_waves, plot_failure_waves, ':')):
+        if not plot:
+            continue
+        for k in range(len(waves)):
+            wave = waves[k:k + 1]
+            start = max(0, int(wave['low1_index'][0]) - padding)
+            end = min(len(candlestick_chart_df), int(wave['retracement_index'][0]) + padding + 1)
+            window = candlestick_chart_df.iloc[start:end]
+            picture, dataset = mpf.plot(window, type='candle', style='charles', volume=False, figsize=(10, 6), returnfig=True)
+            dataset[0].set_title(f"{title} ({status})\n\nDate: ({window.index[0]} - {window.index[-1]})", fontsize=12, pad=12)
+            dataset[0].set_ylabel('')
+            plot_waves(dataset[0], wave, linestyle, offset=start)
+            filename = os.path.join(folder, f"{status}_{wave['low1_index'][0]}_{wave['low2_index'][0]}.jpg")
+            picture.savefig(filename)
+            plt.close(picture)
+            filenames.append(filename)
+
+    return filenames
+
+def chart_filename(filename, folder, chart_windows=False):
+    # Where the 'chart' output of a run goes: one image, or a folder of wave windows
+    base_name = filename.split(".")[0]
+    return f"{folder}/{base_name}_charts" if chart_windows else f"{folder}/{base_name}_chart.jpg"
+
+def render_chart(df, filename, success_waves, failure_waves, chart_windows=False, title=CHART_TITLE):
+    # The 'chart' output of save_outputs(): the whole series, or one chart per wave window (see save_wave_charts)
+    # Returns the written filenames
+    if chart_windows:
+        return save_wave_charts(df, filename, success_waves, failure_waves, plot_success_waves=True, plot_failure_waves=True, title=title)
+    save_chart(df, filename, success_waves, failure_waves, plot_success_waves=True, plot_failure_waves=True, title=title)
+    return [filename]
+
+def block_strata(samples_sorted_by_r):
+    # Red, sideways and green strata of the [block number, r] pairs sorted by r: the lowest, middle and highest third
+    divisor = len(samples_sorted_by_r) // 3
+    return samples_sorted_by_r[:divisor], samples_sorted_by_r[divisor:-divisor], samples_sorted_by_r[-divisor:]
 
-def block_sampling(filename, number_of_splits=30):
+def block_sampling(filename, number_of_splits=30, return_blocks=False, save_blocks=True, cache_folder=None, return_strata=False):
     # Block Sampling
+    # With 'return_blocks', also returns the list of block DataFrames so they can be processed without reading the CSVs back.
+    # Blocks are 'iloc' slices of the loaded file, and writing them to '{base}_{i}_splitted.csv' can be turned off with 'save_blocks'.
+    # Blocks are cut from the date sorted frame (see convert_UNIX_to_datetime), whether it comes from the cache
+    # (see load_file with 'cache_folder') or from the CSV, so a file stored newest first or out of order is split in time order.
+    # With 'return_strata', the block numbers of the whole red, sideways and green strata are returned last, e.g. for resampling.
 
     def split_dataframe(df, number_of_splits):
         # Split a DataFrame into arbitrary number of DataFrames
@@ -478,7 +878,9 @@ def block_sampling(filename, number_of_splits=30):
         else:
             return 0
 
-    df = load_file(filename)
+    df = load_file(filename, cache_folder)
+    if cache_folder is None:
+        df = convert_UNIX_to_datetime(df)
     new_dfs = split_dataframe(df, number_of_splits) # List of DataFrame
     
     correlation_coefficient = {}
@@ -487,17 +889,19 @@ def block_sampling(filename, number_of_splits=30):
         r_value = calculate_correlation_coefficient(new_df)
         correlation_coefficient[i] = [i, round(r_value, 4)]
         # Save each splitted dataframe as csv
-        splitted_filename = f"{filename.split('.')[0]}_{i}_splitted.csv"
-        save_to_csv(new_dfs[i-1], splitted_filename, False)
+        if save_blocks:
+            splitted_filename = f"{filename.split('.')[0]}_{i}_splitted.csv"
+            save_to_csv(new_dfs[i-1], splitted_filename, False)
 
     samples_sorted_by_r = sorted(correlation_coefficient.values(), key=lambda x: x[1])
     print(f"Samples sorted by correlation coefficient: {samples_sorted_by_r}")
 
     # Stratified Random Sampling
     divisor = len(samples_sorted_by_r) // 3
-    red = random.sample(samples_sorted_by_r[:divisor], max(1, divisor//2))
-    green = random.sample(samples_sorted_by_r[-divisor:], max(1, divisor//2))
-    sideways = random.sample(samples_sorted_by_r[divisor:-divisor], max(1, divisor//2))
+    red_stratum, sideways_stratum, green_stratum = block_strata(samples_sorted_by_r)
+    red = random.sample(red_stratum, max(1, divisor//2))
+    green = random.sample(green_stratum, max(1, divisor//2))
+    sideways = random.sample(sideways_stratum, max(1, divisor//2))
 
     print(f"\nYou have requested to split your main file into {number_of_splits} blocks of files.")
     print(f"\nStratified Sampling done. Each block is categorized by the number of green candles / number of candles within each block.")
@@ -507,47 +911,324 @@ def block_sampling(filename, number_of_splits=30):
     print(f"Sideways: {sideways}")
     print(f"Green: {green}\n")
     filenumbers = [x for x, y in red] + [x for x, y in sideways] + [x for x, y in green]
+    strata = [[x for x, y in stratum] for stratum in (red_stratum, sideways_stratum, green_stratum)]
     
-    return filenumbers
+    if return_blocks:
+        return (filenumbers, new_dfs, strata) if return_strata else (filenumbers, new_dfs)
+    return (filenumbers, strata) if return_strata else filenumbers
 
-def run(filename, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000, folder='hypothesis_test'):
-    # Process the given file to analyze
-    # Return detected waves that meet the critera, and those that don't meet the critera
+def cached_local_minima(df, cache_path):
+    # find_local_minima, stored in / read from the cache folder of the frame
+    if cache.has_array(cache_path, 'local_minima'):
+        return cache.open_array(cache_path, 'local_minima')
+    local_minima = find_local_minima(df)
+    cache.save_array(cache_path, 'local_minima', local_minima)
+    return local_minima
+
+def cached_local_lows(df, reset_threshold, cache_path):
+    # compute_local_lows, stored in / read from the cache folder of the frame
+    names = [f"local_lows_{reset_threshold}_{field}" for field in LocalLows.__slots__]
+    if all(cache.has_array(cache_path, name) for name in names):
+        return LocalLows(*(cache.open_array(cache_path, name) for name in names))
+    local_lows = compute_local_lows(df, reset_threshold)
+    for name, field in zip(names, LocalLows.__slots__):
+        cache.save_array(cache_path, name, getattr(local_lows, field))
+    return local_lows
+
+def memoized(memo, stage, key, names, compute, record=None):
+    # compute() through the StageCache 'memo' (see cache.StageCache): the cached arrays of 'key' if there are any,
+    # otherwise compute()'s arrays (one per name), which are cached. 'record' (a profiler stage) notes whether it hit.
+    if memo is None:
+        return compute()
+    arrays = memo.load(stage, key, names)
+    if record is not None:
+        record['memo'] = 'miss' if arrays is None else 'hit'
+    if arrays is None:
+        arrays = compute()
+        memo.save(stage, key, dict(zip(names, arrays)))
+    return arrays
+
+def detect(df, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000, cache_path=None, profiler=None, memo=None, verbose=True):
+    # Data preparation and waves detection on an already loaded DataFrame, nothing is written to disk.
+    # 'df' can be a view (e.g. an iloc block), only a shallow copy is taken before columns are added.
+    # 'cache_path' is the cache folder 'df' was loaded from (see load_file), local minima and local lows are cached there too.
+    # 'profiler' records every stage (see profiling.Profiler)
+    # 'memo' is a cache.StageCache: local minima, local lows, local highs with the candidate pairs, and the resolved waves
+    # are memoized under the fingerprint of the open, high and low prices and of the parameters each of them depends on,
+    # e.g. a rerun with another high2_retracement_ratio only runs search_high2 again.
+    # 'verbose' is passed to search_high2, which prints the wave counts
+    # Returns (df, local_lows, local_highs, success_waves, failure_waves)
+    if profiler is None:
+        profiler = Profiler(enabled=False)
     
     # Data preparation
-    df = load_file(filename)
-    df = convert_UNIX_to_datetime(df)
-    df = add_green_red(df)
-    df = add_tail_range(df)
-    local_low = find_local_minima(df)
-    add_columns(df, local_low, "local_minima", 0, 1)
-    df = add_local_lows(df, reset_threshold)
-    df = convert_local_lows_to_dates(df)
+    df = df.copy(deep=False)
+    with profiler.stage('convert_UNIX_to_datetime', rows=len(df)):
+        df = convert_UNIX_to_datetime(df)
+    with profiler.stage('add_green_red', rows=len(df)):
+        df = add_green_red(df)
+    with profiler.stage('add_tail_range', rows=len(df)):
+        df = add_tail_range(df)
+    data_key = None
+    if memo is not None:
+        with profiler.stage('fingerprint', rows=len(df)):
+            data_key = cache.fingerprint(*(df[column].to_numpy(dtype=float) for column in ('open', 'high', 'low')))
+    with profiler.stage('find_local_minima', rows=len(df)) as stage:
+        if cache_path is not None:
+            local_low = cached_local_minima(df, cache_path)
+        else:
+            local_low, = memoized(memo, 'local_minima', data_key, ['local_minima'], lambda: [find_local_minima(df)], stage)
+        add_columns(df, local_low, "local_minima", 0, 1)
+        stage['local_minima'] = len(local_low)
+    with profiler.stage('compute_local_lows', rows=len(df)) as stage:
+        if cache_path is not None:
+            local_lows = cached_local_lows(df, reset_threshold, cache_path)
+        else:
+            local_lows = LocalLows(*memoized(
+                memo, 'local_lows', cache.fingerprint(data_key, reset_threshold), LocalLows.__slots__,
+                lambda: [getattr(compute_local_lows(df, reset_threshold), field) for field in LocalLows.__slots__], stage
+            ))
+        stage['buffer'] = len(local_lows.index)
 
     # Waves Detection
-    df = detect_waves(df)
-    df = add_local_highs(df)
-    waves = store_unique_pairs_local_lows(df)
-    waves = store_unique_pairs_local_lows_within_fib_levels(waves, retracement_ratio)
-    success_waves, failure_waves = search_high2(df, waves, high2_retracement_ratio, debugging=False)
-    combined_waves = {**success_waves, **failure_waves}
+    with profiler.stage('detect_waves', rows=len(df)):
+        df = detect_waves(df, local_lows)
+    # The local highs and the candidate pairs only depend on the local lows
+    pairs_key = cache.fingerprint(data_key, reset_threshold) if memo is not None else None
+    with profiler.stage('compute_local_highs', buffer=len(local_lows.index)) as stage:
+        range_max = RangeMax(df['high'])
+        local_highs = tuple(memoized(memo, 'local_highs', pairs_key, ['high_index', 'high_price'], lambda: compute_local_highs(local_lows, range_max), stage))
+    with profiler.stage('store_unique_pairs_local_lows') as stage:
+        waves, = memoized(memo, 'pairs', pairs_key, ['pairs'], lambda: [store_unique_pairs_local_lows(df, local_lows, local_highs)], stage)
+        stage['pairs'] = len(waves)
+    with profiler.stage('store_unique_pairs_local_lows_within_fib_levels', pairs=len(waves)) as stage:
+        waves = store_unique_pairs_local_lows_within_fib_levels(waves, retracement_ratio)
+        stage['candidates'] = len(waves)
+    with profiler.stage('search_high2', candidates=len(waves)) as stage:
+        waves_key = cache.fingerprint(pairs_key, retracement_ratio, high2_retracement_ratio) if memo is not None else None
+        success_waves, failure_waves = memoized(
+            memo, 'waves', waves_key, ['success_waves', 'failure_waves'],
+            lambda: search_high2(df, waves, high2_retracement_ratio, debugging=False, range_max=range_max, verbose=verbose), stage
+        )
+        stage['success_waves'], stage['failure_waves'] = len(success_waves), len(failure_waves)
+
+    return df, local_lows, local_highs, success_waves, failure_waves
+
+def point_lists(index, price, start, length):
+    # Arrow list<struct<index: int64, price: float64>> with the points index/price[start[i] : start[i] + length[i]] in row i.
+    # Null points (index -1) are written as nulls.
+    offsets = np.r_[0, np.cumsum(length)]
+    positions = np.repeat(start - offsets[:-1], length) + np.arange(offsets[-1])
+    point_index = index[positions]
+    points = pa.StructArray.from_arrays(
+        [pa.array(point_index, type=pa.int64()), pa.array(price[positions], type=pa.float64())],
+        names=['index', 'price'],
+        mask=pa.array(point_index < 0),
+    )
+    return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), points)
+
+def processed_row_groups(length, row_group_size=65536, max_group_points=1 << 22):
+    # (first row, end row) of every row group: at most 'row_group_size' rows and, past its first row,
+    # at most 'max_group_points' local lows, so memory stays bounded however deep the stacks are
+    points = np.cumsum(length)
+    groups = []
+    a = 0
+    while a < len(length):
+        before = points[a - 1] if a > 0 else 0
+        b = min(a + row_group_size, int(np.searchsorted(points, before + max_group_points, side='right')))
+        b = max(b, a + 1)
+        groups.append((a, b))
+        a = b
+    return groups
+
+def save_processed_parquet(df, filename, local_lows, local_highs, row_group_size=65536, max_group_points=1 << 22):
+    # Typed counterpart of the processed CSV: the columns of 'df' as they are, plus
+    #   local_lows  : list<struct<index, price>>, every row's local lows stack
+    #   local_highs : list<struct<index, price>>, the highest high between each pair of neighbouring lows,
+    #                 null for rows with fewer than two lows (like the empty cells of the CSV)
+    # Dates of the lows (local_lows_converted in the CSV) are df['date'] at their index, and tail_range is tail_low / tail_high.
+    # Row groups are built and written one at a time (see processed_row_groups).
+    if pa is None:
+        raise ImportError("Parquet outputs need pyarrow, pip install pyarrow")
+    high_index, high_price = local_highs
+    has_highs = local_lows.length > 1
+    writer = None
+    try:
+        for a, b in processed_row_groups(local_lows.length, row_group_size, max_group_points):
+            start, length = local_lows.start[a:b], local_lows.length[a:b]
+            table = pa.Table.from_pandas(df.iloc[a:b], preserve_index=False)
+            table = table.append_column('local_lows', point_lists(local_lows.index, local_lows.price, start, length))
+            local_highs_column = point_lists(high_index, high_price, start + 1, np.where(has_highs[a:b], length - 1, 0))
+            local_highs_column = pa.ListArray.from_arrays(local_highs_column.offsets, local_highs_column.values, mask=pa.array(~has_highs[a:b]))
+            table = table.append_column('local_highs', local_highs_column)
+            if writer is None:
+                writer = pq.ParquetWriter(filename, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def save_outputs(filename, folder, df, local_lows, local_highs, success_waves, failure_waves, outputs=('result', 'processed', 'chart'), profiler=None, chart_windows=False, chart_renderer=None, writer=None):
+    # Write the requested artifacts of one detect() run, named after 'filename':
+    #   'result'    : {base_name}_result.csv, one row per wave
+    #   'processed' : {base_name}_processed.csv, the frame with the legacy string columns
+    #   'chart'     : {base_name}_chart.jpg, or with 'chart_windows' one chart per wave in {base_name}_charts/
+    #   'result_parquet'    : {base_name}_result.parquet, the result rows with their types
+    #   'processed_parquet' : {base_name}_processed.parquet, typed processed frame (see save_processed_parquet)
+    # With 'chart_renderer' (see charts.ChartRenderer), the chart is handed to its background workers instead of drawn here.
+    # With 'writer' (see background_io.BackgroundWriter), files are queued to its thread, the save stages then time the queueing.
+    # Returns the result DataFrame
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    write = writer.submit if writer is not None else lambda function, *args, **kwargs: function(*args, **kwargs)
+    base_name = filename.split(".")[0]
+    with profiler.stage('build_result_df', waves=len(success_waves) + len(failure_waves)):
+        result_df = build_result_df(df, np.concatenate([success_waves, failure_waves]))
+    if 'result' in outputs:
+        with profiler.stage('save_result_csv', rows=len(result_df)):
+            write(result_df.to_csv, f"{folder}/{base_name}_result.csv", index=False)
+    if 'result_parquet' in outputs:
+        with profiler.stage('save_result_parquet', rows=len(result_df)):
+            write(result_df.to_parquet, f"{folder}/{base_name}_result.parquet", index=False)
+    if 'processed_parquet' in outputs:
+        with profiler.stage('save_processed_parquet', rows=len(df)):
+            # A shallow copy, the 'processed' columns below are added to 'df' in place while the write may still be queued
+            write(save_processed_parquet, df.copy(deep=False), f"{folder}/{base_name}_processed.parquet", local_lows, local_highs)
+    if 'processed' in outputs:
+        with profiler.stage('processed_columns', rows=len(df)):
+            df = add_tail_range(df, legacy=True)
+            df = add_local_lows(df, local_lows=local_lows)
+            df = convert_local_lows_to_dates(df, local_lows)
+            df = add_local_highs(df, local_lows, local_highs)
+        with profiler.stage('save_processed_csv', rows=len(df)):
+            write(save_to_csv, df, f"{folder}/{base_name}_processed.csv", True)
+    if 'chart' in outputs:
+        if chart_renderer is not None:
+            with profiler.stage('submit_chart', rows=len(df)):
+                chart_renderer.submit(df, chart_filename(filename, folder, chart_windows), success_waves, failure_waves, chart_windows)
+        else:
+            with profiler.stage('save_chart', rows=len(df)):
+                render_chart(df, chart_filename(filename, folder, chart_windows), success_waves, failure_waves, chart_windows)
+
+    return result_df
+
+def run(filename, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000, folder='hypothesis_test', df=None, outputs=None, cache_folder=None, profile=False, profiler=None, chart_windows=False, chart_renderer=None, chunksize=None):
+    # Process the given file to analyze
+    # Return detected waves that meet the critera, and those that don't meet the critera
+    # If 'df' is given (e.g. a block from block_sampling), it is analyzed instead of loading 'filename',
+    # which is then only used to name the output files. 'outputs' selects the files written by save_outputs(),
+    # by default ('result', 'processed', 'chart'), or only ('result',) with 'chunksize'.
+    # With 'cache_folder', the loaded frame, local minima and local lows are cached for the next runs (see load_file).
+    # With 'profile', a per-stage report of the run is written to {folder}/{base_name}_profile.json
+    # 'profiler' records the stages into an existing Profiler instead, e.g. one without memory tracing (see benchmark.py)
+    # 'chart_windows' and 'chart_renderer' are passed to save_outputs()
+    # With 'chunksize', the CSV is streamed in chunks of that many rows for files larger than memory (see streaming.detect_chunked).
+    # The waves are the same as in memory, but only the 'result' output can be written then, asking for the others raises a ValueError.
+    base_name = filename.split(".")[0]
+    if profiler is None:
+        profiler = Profiler(base_name, enabled=profile)
+    if chunksize is not None:
+        from streaming import detect_chunked     # streaming imports this module
+        if outputs is None:
+            outputs = ('result',)
+        if any(output != 'result' for output in outputs):
+            raise ValueError(f"Chunked runs only write the 'result' output, got outputs={outputs}")
+        success_waves, failure_waves, result_df = detect_chunked(filename, chunksize, retracement_ratio, high2_retracement_ratio, reset_threshold, profiler)
+        if 'result' in outputs:
+            with profiler.stage('save_result_csv', rows=len(result_df)):
+                result_df.to_csv(f"{folder}/{base_name}_result.csv", index=False)
+        if profile:
+            profiler.save(f"{folder}/{base_name}_profile.json")
+        return success_waves, failure_waves
+    if outputs is None:
+        outputs = ('result', 'processed', 'chart')
+    cache_path = None
+    if df is None:
+        with profiler.stage('load_file') as stage:
+            df = load_file(filename, cache_folder)
+            stage['rows'] = len(df)
+        if cache_folder is not None:
+            cache_path = cache.cache_path(filename, cache_folder)
+    df, local_lows, local_highs, success_waves, failure_waves = detect(df, retracement_ratio, high2_retracement_ratio, reset_threshold, cache_path, profiler)
     
     # Save Results to files
-    base_name = filename.split(".")[0]
-    save_combined_waves_df(df, combined_waves, f"{folder}/{base_name}_result.csv", True)
-    save_to_csv(df, f"{folder}/{base_name}_processed.csv", True)
-    save_chart(
-        df, 
-        f"{folder}/{base_name}_chart.jpg", 
-        success_waves, 
-        failure_waves, 
-        plot_success_waves=True, 
-        plot_failure_waves=True
-    )
+    save_outputs(filename, folder, df, local_lows, local_highs, success_waves, failure_waves, outputs, profiler, chart_windows, chart_renderer)
+    if profile:
+        profiler.save(f"{folder}/{base_name}_profile.json")
     
     return success_waves, failure_waves
 
 
+def sweep(filename, retracement_ratios=(0.618,), high2_retracement_ratios=(0.382,), reset_thresholds=(100000,)):
+    # Evaluate a grid of parameters without rerunning the whole pipeline for each combination.
+    #   once                      : load_file, convert_UNIX_to_datetime, find_local_minima, RangeMax
+    #   once per reset_threshold  : local lows, local highs, unique pairs, find_breakouts() for every pair
+    #                               that passes the fib filter of any retracement_ratio
+    #   once per high2 ratio      : find_retracements() and high2 on that shared candidate set
+    #   whole retracement grid    : the fib filter as one (ratios x waves) mask, aggregated with matrix products
+    # Returns a DataFrame with one row per (reset_threshold, retracement_ratio, high2_retracement_ratio).
+    df = load_file(filename)
+    df = convert_UNIX_to_datetime(df)
+    local_low = find_local_minima(df)
+    add_columns(df, local_low, "local_minima", 0, 1)
+    range_max = RangeMax(df['high'])
+    high, low = df['high'].to_numpy(dtype=float), df['low'].to_numpy(dtype=float)
+    s1_open = df['open'].to_numpy(dtype=float)
+    ratios = np.asarray(retracement_ratios, dtype=float)[:, None]
+
+    def within_fib_levels(records):
+        # (ratios x records) mask, same condition as store_unique_pairs_local_lows_within_fib_levels
+        low1_price, high1_price, low2_price = records['low1_price'], records['high1_price'], records['low2_price']
+        fib_level = high1_price - (high1_price - low1_price) * ratios
+        return (low1_price < low2_price) & (low2_price <= fib_level)
+
+    rows = []
+    for reset_threshold in reset_thresholds:
+        local_lows = compute_local_lows(df, reset_threshold)
+        df = detect_waves(df, local_lows)
+        local_highs = compute_local_highs(local_lows, range_max)
+        pairs = store_unique_pairs_local_lows(df, local_lows, local_highs)
+        candidates = pairs[within_fib_levels(pairs).any(axis=0)]
+        candidate_count = within_fib_levels(candidates).sum(axis=1)
+        breakouts = find_breakouts(high, low, candidates['low2_index'] + 2, candidates['low1_price'], candidates['high1_price'])
+
+        for high2_retracement_ratio in high2_retracement_ratios:
+            success_waves, failure_waves = search_high2(df, candidates, high2_retracement_ratio, range_max=range_max, breakouts=breakouts, verbose=False)
+            waves = np.concatenate([success_waves, failure_waves])
+            within = within_fib_levels(waves).astype(float)
+            success = within[:, :len(success_waves)].sum(axis=1)
+            failure = within[:, len(success_waves):].sum(axis=1)
+            n = success + failure
+
+            # Hypothesis testing on 'wave3_max - wave1_max', one-tailed t-test per ratio
+            diff = waves['high2_price'] - waves['high1_price']
+            s1_entry = s1_open[waves['low2_index'] + 2]
+            s1_value = np.where(waves['high2_price'] > waves['high1_price'], waves['retracement_price'], waves['low1_price']) - s1_entry
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_difference = within @ diff / n
+                std_difference = np.sqrt((within @ diff ** 2 - n * mean_difference ** 2) / (n - 1))
+                t_statistic = mean_difference / (std_difference / np.sqrt(n))
+                s1_expected_value = within @ s1_value / n
+
+            for r, retracement_ratio in enumerate(retracement_ratios):
+                rows.append({
+                    'reset_threshold': reset_threshold,
+                    'retracement_ratio': retracement_ratio,
+                    'high2_retracement_ratio': high2_retracement_ratio,
+                    'candidates': int(candidate_count[r]),
+                    'success_waves': int(success[r]),
+                    'failure_waves': int(failure[r]),
+                    'uncounted_waves': int(candidate_count[r] - n[r]),
+                    'success_ratio': success[r] / n[r] if n[r] > 0 else 0,
+                    'mean_difference': mean_difference[r],
+                    't_statistic': t_statistic[r],
+                    'p_value': t.sf(t_statistic[r], df=n[r] - 1),
+                    's1_expected_value': s1_expected_value[r],
+                })
+
+    return pd.DataFrame(rows)
+
+
 if __name__ == "__main__": 
     filename = "btc_historical.csv"
     folder = "hypothesis_test"
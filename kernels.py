@@ -0,0 +1,272 @@
+import os
+import heapq
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Compiled kernels for the sequential loops of the pipeline, on plain float / int arrays:
+#   local_lows_buffer  : the local lows stack with its reset threshold (compute_local_lows)
+#   find_breakouts     : candidates falling below low1 or exceeding high1 (search_high2)
+#   find_retracements  : success candidates retracing to their Fibonacci level (search_high2)
+# Each kernel returns exactly what the pure-Python function of the same name in elliott_wave_theory returns.
+#
+# The backend is picked at runtime: 'numba' when Numba is installed, 'python' otherwise.
+# The ELLIOTT_WAVE_BACKEND environment variable or set_backend() overrides it, e.g. to compare both (see benchmark.py).
+# Kernels are compiled on first use and cached next to this file, so later runs start without compiling.
+
+BACKENDS = ('python', 'numba')
+backend = os.environ.get('ELLIOTT_WAVE_BACKEND', 'numba' if njit is not None else 'python')
+
+def set_backend(name):
+    global backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, choose one of {BACKENDS}")
+    if name == 'numba' and njit is None:
+        raise ImportError("The 'numba' backend needs Numba, pip install numba")
+    backend = name
+
+def use_numba():
+    return backend == 'numba' and njit is not None
+
+def compiled(function):
+    # njit(cache=True) when Numba is installed, the kernels are never called otherwise
+    return njit(cache=True)(function) if njit is not None else function
+
+def warm_up():
+    # Compiles (or loads from the cache) every kernel for the argument types elliott_wave_theory passes them,
+    # e.g. before a process limits its address space: the JIT aborts the process instead of raising a MemoryError
+    # when it cannot allocate, and kernels that are ready need no more JIT memory.
+    # The high and low columns come writable or read-only (copy-on-write views, memory mapped frames), a type each.
+    if not use_numba():
+        return
+    rows, prices = np.zeros(1, dtype=np.int64), np.ones(1)
+    read_only = np.ones(1)
+    read_only.flags.writeable = False
+    local_lows_buffer(rows, prices, 1)
+    for column in (prices, read_only):
+        find_breakouts(column, column, rows, prices, prices)
+        find_retracements(column, column, rows, prices, 0.382)
+
+@compiled
+def grow(array, size):
+    # 'array' with room for at least 'size' items, doubling its capacity
+    if size <= len(array):
+        return array
+    grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+@compiled
+def local_lows_buffer(event_rows, event_low, reset_threshold):
+    # Returns (buffer_index, buffer_price, event_start, event_length), see elliott_wave_theory.local_lows_buffer
+    m = len(event_rows)
+    event_start = np.zeros(m, dtype=np.int64)
+    event_length = np.zeros(m, dtype=np.int64)
+    buffer_index = np.empty(max(16, 2 * m), dtype=np.int64)
+    buffer_price = np.empty(max(16, 2 * m), dtype=np.float64)
+    size, start, length = 0, 0, 0
+    for e in range(m):
+        i, low_price = event_rows[e], event_low[e]
+        if length == 0:
+            buffer_index, buffer_price = grow(buffer_index, size + 1), grow(buffer_price, size + 1)
+            start = size
+            buffer_index[size], buffer_price[size] = i, low_price
+            size += 1
+            length = 1
+        else:
+            last_local_low = buffer_price[start + length - 1]
+            if low_price > last_local_low:
+                buffer_index, buffer_price = grow(buffer_index, size + 1), grow(buffer_price, size + 1)
+                buffer_index[size], buffer_price[size] = i, low_price
+                size += 1
+                length += 1
+            elif low_price < last_local_low:
+                kept = length
+                while kept > 0 and buffer_price[start + kept - 1] > low_price:
+                    kept -= 1
+                if length - kept >= reset_threshold:
+                    kept = 0
+                buffer_index, buffer_price = grow(buffer_index, size + kept + 1), grow(buffer_price, size + kept + 1)
+                new_start = size
+                buffer_index[size:size + kept] = buffer_index[start:start + kept]
+                buffer_price[size:size + kept] = buffer_price[start:start + kept]
+                size += kept
+                buffer_index[size], buffer_price[size] = i, low_price
+                size += 1
+                start, length = new_start, kept + 1
+        event_start[e] = start
+        event_length[e] = length
+
+    return buffer_index[:size].copy(), buffer_price[:size].copy(), event_start, event_length
+
+@compiled
+def find_breakouts(high, low, start, low1_price, high1_price):
+    # Returns (breakout_index, exceeded), see elliott_wave_theory.find_breakouts
+    n = len(high)
+    breakout_index = np.full(len(start), -1, dtype=np.int64)
+    exceeded = np.zeros(len(start), dtype=np.bool_)
+    resolved = np.zeros(len(start), dtype=np.bool_)
+    order = np.argsort(start, kind='mergesort')
+    order = order[start[order] < n]
+    # Seeded and emptied so Numba knows the heap item type
+    falls_below = [(0.0, 0)]
+    exceeds = [(0.0, 0)]
+    falls_below.pop()
+    exceeds.pop()
+    k = 0
+    i = start[order[0]] if len(order) else n
+    while i < n:
+        while k < len(order) and start[order[k]] == i:
+            c = order[k]
+            heapq.heappush(falls_below, (-low1_price[c], c))
+            heapq.heappush(exceeds, (high1_price[c], c))
+            k += 1
+        while len(falls_below) and -falls_below[0][0] >= low[i]:
+            c = heapq.heappop(falls_below)[1]
+            if not resolved[c]:
+                resolved[c] = True
+                breakout_index[c] = i
+        while len(exceeds) and exceeds[0][0] < high[i]:
+            c = heapq.heappop(exceeds)[1]
+            if not resolved[c]:
+                resolved[c] = True
+                breakout_index[c] = i
+                exceeded[c] = True
+        # Skip ahead to the next candidate when nothing is open
+        if len(falls_below) == 0 and k < len(order):
+            i = max(i + 1, start[order[k]])
+        elif len(falls_below) == 0:
+            break
+        else:
+            i += 1
+
+    return breakout_index, exceeded
+
+@compiled
+def pairing_meld(key, child, sibling, a, b):
+    # Root of the pairing heap melding the heaps rooted at nodes 'a' and 'b' (-1 is the empty heap).
+    # Nodes are candidates ordered by (key, node), the children of a node are linked through 'sibling'.
+    if a < 0:
+        return b
+    if b < 0:
+        return a
+    if key[b] < key[a] or (key[b] == key[a] and b < a):
+        a, b = b, a
+    sibling[b] = child[a]
+    child[a] = b
+    return a
+
+@compiled
+def pairing_pop(key, child, sibling, root, pairs):
+    # Root of the heap left once 'root' is removed: its children are melded two by two, then from the last pair back.
+    # 'pairs' is scratch space with room for every node.
+    count = 0
+    a = child[root]
+    while a >= 0:
+        b = sibling[a]
+        next_child = sibling[b] if b >= 0 else -1
+        sibling[a] = -1
+        if b >= 0:
+            sibling[b] = -1
+        pairs[count] = pairing_meld(key, child, sibling, a, b)
+        count += 1
+        a = next_child
+    child[root] = -1
+    merged = -1
+    for j in range(count - 1, -1, -1):
+        merged = pairing_meld(key, child, sibling, pairs[j], merged)
+    return merged
+
+@compiled
+def push_level(levels, g, group_max, group_root, group_version, low2_price, ratio):
+    # Fibonacci level of group g's best candidate into the levels heap, older entries of g become stale
+    group_version[g] += 1
+    root = group_root[g]
+    if root >= 0:
+        cur_max = group_max[g]
+        heapq.heappush(levels, (-(cur_max - ((cur_max - low2_price[root]) * ratio)), g, group_version[g]))
+
+@compiled
+def find_retracements(high, low, exceeded_index, low2_price, high2_retracement_ratio):
+    # Returns (exit_index, high2_end), see elliott_wave_theory.find_retracements.
+    # The same groups of candidates sharing a running max, stack of groups and heap of group levels,
+    # with each group's candidates in an array-backed pairing heap, so merging groups under a new high is O(1).
+    n = len(high)
+    m = len(exceeded_index)
+    exit_index = np.full(m, n - 1, dtype=np.int64)
+    high2_end = np.full(m, n - 1, dtype=np.int64)
+    ratio = high2_retracement_ratio
+    # fib_level grows with low2 when ratio >= 0 and shrinks otherwise
+    key = -low2_price if ratio >= 0 else low2_price.copy()
+    child = np.full(m, -1, dtype=np.int64)
+    sibling = np.full(m, -1, dtype=np.int64)
+    pairs = np.empty(m, dtype=np.int64)
+    order = np.argsort(exceeded_index, kind='mergesort')
+    order = order[exceeded_index[order] < n - 1]
+
+    group_max = np.empty(m, dtype=np.float64)
+    group_root = np.full(m, -1, dtype=np.int64)
+    group_version = np.zeros(m, dtype=np.int64)
+    stack = np.empty(m, dtype=np.int64)
+    stack_size, groups = 0, 0
+    # Seeded and emptied so Numba knows the heap item type
+    levels = [(0.0, 0, 0)]
+    levels.pop()
+
+    k = 0
+    i = exceeded_index[order[0]] if len(order) else n
+    while i < n - 1:
+        cur_high, cur_low = high[i], low[i]
+        # A higher high becomes the running max of every group below it.
+        # Levels of the merged groups are checked with the new max before they merge.
+        merged = -1
+        while stack_size > 0 and group_max[stack[stack_size - 1]] < cur_high:
+            stack_size -= 1
+            g = stack[stack_size]
+            root = group_root[g]
+            while root >= 0 and cur_high - ((cur_high - low2_price[root]) * ratio) >= cur_low:
+                exit_index[root] = i
+                high2_end[root] = i - 1
+                root = pairing_pop(key, child, sibling, root, pairs)
+            group_root[g] = -1
+            group_version[g] += 1
+            if merged < 0:
+                merged = g
+                group_root[g] = root
+            else:
+                group_root[merged] = pairing_meld(key, child, sibling, group_root[merged], root)
+        if merged >= 0:
+            group_max[merged] = cur_high
+            stack[stack_size] = merged
+            stack_size += 1
+            push_level(levels, merged, group_max, group_root, group_version, low2_price, ratio)
+
+        while len(levels) and -levels[0][0] >= cur_low:
+            _, g, version = heapq.heappop(levels)
+            if version != group_version[g]:
+                continue
+            root = group_root[g]
+            exit_index[root] = i
+            high2_end[root] = i - 1
+            group_root[g] = pairing_pop(key, child, sibling, root, pairs)
+            push_level(levels, g, group_max, group_root, group_version, low2_price, ratio)
+
+        # Candidates exceeding high1 on this candle start being checked on the next one
+        while k < len(order) and exceeded_index[order[k]] == i:
+            c = order[k]
+            if stack_size > 0 and group_max[stack[stack_size - 1]] == cur_high:
+                g = stack[stack_size - 1]
+            else:
+                g = groups
+                groups += 1
+                group_max[g] = cur_high
+                stack[stack_size] = g
+                stack_size += 1
+            group_root[g] = pairing_meld(key, child, sibling, group_root[g], c)
+            push_level(levels, g, group_max, group_root, group_version, low2_price, ratio)
+            k += 1
+        i += 1
+
+    return exit_index, high2_end
@@ -0,0 +1,86 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Per-stage instrumentation: wall time, peak memory (tracemalloc) and counts of every stage of a run.
+#
+#   profiler = Profiler('btc_historical')
+#   with profiler.stage('find_local_minima', rows=len(df)) as stage:
+#       local_low = find_local_minima(df)
+#       stage['local_minima'] = len(local_low)
+#   profiler.save('hypothesis_test/btc_historical_profile.json')
+#
+# Pipeline functions take profiler=None and use a disabled Profiler then, which records nothing.
+# Hooks are called with every finished stage record, e.g. Profiler('run', hooks=[print]) prints stages as they end.
+# Stages can be nested, a stage's peak memory includes its inner stages, also those of other Profilers
+# (e.g. run()'s stages inside process_data's 'run_blocks').
+
+# [memory before, highest peak of finished inner stages] of the stages being run, of every Profiler:
+# tracemalloc has one peak for the whole process, which each stage resets
+open_stages = []
+
+class Profiler:
+    def __init__(self, name='run', enabled=True, trace_memory=True, hooks=()):
+        # 'trace_memory' turns tracemalloc on, which slows down allocation heavy Python code, turn it off for timings only
+        self.name = name
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.hooks = list(hooks)
+        self.stages = []
+        self.depth = 0              # stages of this profiler being run
+        self.started_tracing = False
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        # Yields the stage record, counts known only at the end of the stage can be added to it
+        record = {'stage': name, **counts}
+        if not self.enabled:
+            yield record
+            return
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            if open_stages:
+                # reset_peak() below would lose the outer stage's peak so far
+                open_stages[-1][1] = max(open_stages[-1][1], peak)
+            tracemalloc.reset_peak()
+            open_stages.append([current, 0])
+        record['depth'] = self.depth
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self.depth -= 1
+            if self.trace_memory:
+                memory_before, inner_peak = open_stages.pop()
+                peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+                record['peak_memory_mb'] = (peak - memory_before) / 2 ** 20
+                if open_stages:
+                    open_stages[-1][1] = max(open_stages[-1][1], peak)
+            self.stages.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def report(self):
+        # Stages in the order they finished (inner stages before the stage containing them)
+        return {
+            'name': self.name,
+            'total_seconds': time.perf_counter() - self.start_time,
+            'peak_memory_mb': max((record.get('peak_memory_mb', 0) for record in self.stages), default=0),
+            'stages': self.stages,
+        }
+
+    def save(self, filename):
+        # Writes the JSON report, and stops tracemalloc if this profiler started it and no stage is being run
+        if self.started_tracing and not open_stages:
+            tracemalloc.stop()
+            self.started_tracing = False
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
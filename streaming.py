@@ -0,0 +1,427 @@
+import heapq
+from bisect import bisect_left
+from collections import deque
+import numpy as np
+import pandas as pd
+from elliott_wave_theory import WAVE_DTYPE, WAVE_POINTS, build_result_df, convert_UNIX_to_datetime, date_strings, load_file
+from profiling import Profiler
+
+# Incremental waves detection for live candle feeds.
+# WaveDetector.push(candle) takes one candle at a time and only keeps the state the batch pipeline (detect() / run())
+# still needs going forward:
+#   - the local lows stack of compute_local_lows(), with the highest high between neighbouring lows (local highs)
+#   - the candles of the current run of equal lows, because find_peaks() puts the minimum of a flat bottom in its middle
+#   - the open search_high2() candidates, waiting to break out (find_breakouts) or to retrace (find_retracements)
+#   - the highs that can still become high2 of an open candidate
+# A point is (row index, price, date), rows are numbered from 0 in the order candles are pushed.
+# Replaying a file and calling finish() gives exactly the waves of run() on that file, see replay().
+
+def higher_point(left, right):
+    # Highest of two points, the left (earlier) one on ties like RangeMax. Either can be None.
+    if left is None or (right is not None and right[1] > left[1]):
+        return right
+    return left
+
+def highest_point(candles):
+    # Highest high of candles (index, open, high, low, date) as a point, None if there are none
+    highest = None
+    for candle in candles:
+        highest = higher_point(highest, (candle[0], candle[2], candle[4]))
+    return highest
+
+class WaveDetector:
+    # Every candle does a constant amount of work plus heap operations for the candidates it resolves.
+    # Candles of a run of equal lows are kept until the run ends, as the local minimum can only be placed then.
+    #
+    # Success waves are emitted on the candle that retraces, failure waves on the candle that falls below low1.
+    # At the end of a file, run() ends waves still waiting for their retracement on the last candle,
+    # and does not check the last candle for retracements: finish() does the same, see finish().
+    def __init__(self, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000):
+        self.retracement_ratio = retracement_ratio
+        self.high2_retracement_ratio = high2_retracement_ratio
+        self.reset_threshold = reset_threshold
+        self.rows = 0
+        self.last_candle = None
+
+        # Local minima: candles (index, open, high, low, date) of the current run of equal lows,
+        # and whether the run started below the previous low
+        self.plateau = []
+        self.plateau_falling = False
+
+        # Local lows: stack of (low point, highest point since the previous local low up to this one),
+        # and the highest point after the top of the stack, before the current run of equal lows
+        self.local_lows = []
+        self.tail = None
+
+        # Candidates are dictionaries, 'seq' is their position in the batch candidate order
+        self.candidates = 0
+        self.alive = deque()        # unresolved candidates in creation order, to know which highs are still needed
+        self.starting = []          # candidates searched from the next candle (low2_index + 2) on
+        self.open = {}              # seq -> candidate waiting for a breakout
+        self.falls_below = []       # max-heap of low1 prices of self.open
+        self.exceeds = []           # min-heap of high1 prices of self.open
+        self.exceeded = {}          # seq -> candidate waiting for a retracement
+
+        # Retracement groups, as in find_retracements(): g -> [running max, heap of members keyed by low2, version]
+        # group_stack holds the groups by decreasing running max, levels the best Fibonacci level of every group
+        self.groups = {}
+        self.group_stack = []
+        self.levels = []
+        self.next_group = 0
+        self.sign = 1 if high2_retracement_ratio >= 0 else -1
+
+        # Highs that are not exceeded by a later high (non-increasing), the highest high since any row is among them.
+        # Entries before high_head are older than every open candidate and are dropped in batches.
+        self.high_index = []
+        self.high_points = []
+        self.high_head = 0
+
+        # Resolved waves as [seq, low1, high1, low2, high2, retracement, s1_entry]
+        self.success = []
+        self.failure = []
+        self.last_retraced = []
+
+    def push(self, candle):
+        # Takes the next candle, a mapping with open, high, low and date (or a 'unix' / 'time' timestamp in seconds)
+        # Returns the events of the waves resolved on this candle, see wave_event()
+        if 'date' in candle:
+            date = candle['date']
+        else:
+            date = pd.to_datetime(candle['unix'] if 'unix' in candle else candle['time'], unit='s')
+        return self.push_values(float(candle['open']), float(candle['high']), float(candle['low']), date)
+
+    def push_values(self, open, high, low, date):
+        i = self.rows
+        candle = (i, open, high, low, date)
+        events = []
+        self.last_retraced = []
+
+        # Candidates created on the previous candle start being searched on this one
+        for c in self.starting:
+            c['s1_entry'] = open
+            self.wait_for_breakout(c)
+        self.starting = []
+
+        # Breakouts: falling below low1 is checked first, so a candle doing both counts as a failure
+        while self.falls_below and -self.falls_below[0][0] >= low:
+            c = self.open.pop(heapq.heappop(self.falls_below)[1], None)
+            if c is not None:
+                # high2 is the highest high before this candle, or the open price if it falls below on low2_index + 2 itself
+                high2 = self.highest_since(c['start']) or (i, open, date)
+                events.append(self.resolve(c, 'failure', high2, (i, low, date)))
+        exceeded = []
+        while self.exceeds and self.exceeds[0][0] < high:
+            c = self.open.pop(heapq.heappop(self.exceeds)[1], None)
+            if c is not None:
+                c['breakout'] = i
+                exceeded.append(c)
+
+        # Retracements of the candidates that exceeded high1 on an earlier candle
+        for c in self.retrace(high, low):
+            events.append(self.resolve(c, 'success', self.highest_since(c['breakout']), (i, low, date)))
+            self.last_retraced.append(self.success[-1])
+        for c in exceeded:
+            self.wait_for_retracement(c, high)
+
+        while len(self.high_index) > self.high_head and self.high_points[-1][1] < high:
+            self.high_index.pop()
+            self.high_points.pop()
+        self.high_index.append(i)
+        self.high_points.append((i, high, date))
+
+        # Local minima, find_peaks(-low): a run of equal lows below its neighbours has its minimum in the middle
+        if self.plateau and low != self.plateau[-1][3]:
+            plateau, self.plateau = self.plateau, []
+            if low > plateau[-1][3] and self.plateau_falling:
+                events.extend(self.local_minimum(plateau, candle))
+            else:
+                self.tail = higher_point(self.tail, highest_point(plateau))
+            self.plateau_falling = low < plateau[-1][3]
+        self.plateau.append(candle)
+
+        self.rows += 1
+        self.last_candle = candle
+        self.trim()
+        return events
+
+    def local_minimum(self, plateau, candle):
+        # A local minimum confirmed by 'candle', the first higher low after 'plateau'.
+        # Updates the local lows stack like compute_local_lows() and turns the new (low1, low2) pair into a candidate.
+        start = plateau[0][0]
+        m = (start + plateau[-1][0]) // 2
+        bottom = plateau[m - start]
+        low2 = (m, bottom[3], bottom[4])
+        before = highest_point(plateau[:m - start])
+        low1, high1 = None, None
+        if not self.local_lows:
+            self.local_lows.append((low2, (m, bottom[2], bottom[4])))
+        elif low2[1] == self.local_lows[-1][0][1]:
+            # An equal low leaves the stack as it is
+            self.tail = higher_point(self.tail, highest_point(plateau))
+            return []
+        else:
+            kept = len(self.local_lows)
+            while kept > 0 and self.local_lows[kept - 1][0][1] > low2[1]:
+                kept -= 1
+            if kept < len(self.local_lows) and len(self.local_lows) - kept >= self.reset_threshold:
+                kept = 0
+            if kept > 0:
+                # Highest high between the kept top and the new low, across the popped lows
+                for _, through in self.local_lows[kept:]:
+                    high1 = higher_point(high1, through)
+                high1 = higher_point(higher_point(high1, self.tail), before)
+                low1 = self.local_lows[kept - 1][0]
+            del self.local_lows[kept:]
+            self.local_lows.append((low2, higher_point(high1, (m, bottom[2], bottom[4]))))
+        self.tail = highest_point(plateau[m - start + 1:])
+
+        # store_unique_pairs_local_lows_within_fib_levels
+        if low1 is None:
+            return []
+        fib_level = high1[1] - (high1[1] - low1[1]) * self.retracement_ratio
+        if not (low1[1] < low2[1] and low2[1] <= fib_level):
+            return []
+        c = {'seq': self.candidates, 'low1': low1, 'high1': high1, 'low2': low2, 'start': m + 2, 's1_entry': None, 'breakout': None, 'status': None}
+        self.candidates += 1
+
+        # The candles after low2 may already be here: run search_high2 on them, then hand the candidate over
+        later = plateau[m - start + 1:] + [candle]
+        if later[0][2] > high1[1]:
+            # The immediate candle after low2 already exceeds high1: not counted
+            c['status'] = 'uncounted'
+            return []
+        self.alive.append(c)
+        searched = later[1:]
+        if not searched:
+            self.starting.append(c)
+            return []
+        c['s1_entry'] = searched[0][1]
+        for k, row in enumerate(searched):
+            if low1[1] >= row[3]:
+                high2 = highest_point(searched[:k]) or (row[0], row[1], row[4])
+                return [self.resolve(c, 'failure', high2, (row[0], row[3], row[4]))]
+            if high1[1] < row[2]:
+                c['breakout'] = row[0]
+                cur_max = row[2]
+                for r in range(k + 1, len(searched)):
+                    cur_max = max(cur_max, searched[r][2])
+                    if self.fib_level(cur_max, c) >= searched[r][3]:
+                        event = self.resolve(c, 'success', highest_point(searched[k:r]), (searched[r][0], searched[r][3], searched[r][4]))
+                        if searched[r] is candle:
+                            self.last_retraced.append(self.success[-1])
+                        return [event]
+                self.wait_for_retracement(c, cur_max)
+                return []
+        self.wait_for_breakout(c)
+        return []
+
+    def wait_for_breakout(self, c):
+        self.open[c['seq']] = c
+        heapq.heappush(self.falls_below, (-c['low1'][1], c['seq']))
+        heapq.heappush(self.exceeds, (c['high1'][1], c['seq']))
+
+    def fib_level(self, cur_max, c):
+        return cur_max - ((cur_max - c['low2'][1]) * self.high2_retracement_ratio)
+
+    def push_level(self, g):
+        group = self.groups[g]
+        group[2] += 1
+        if group[1]:
+            heapq.heappush(self.levels, (-self.fib_level(group[0], self.exceeded[group[1][0][1]]), g, group[2]))
+
+    def wait_for_retracement(self, c, cur_max):
+        # Joins the group with the same running max, or a new one at its place in the stack
+        self.exceeded[c['seq']] = c
+        position = bisect_left(self.group_stack, -cur_max, key=lambda g: -self.groups[g][0])
+        if position < len(self.group_stack) and self.groups[self.group_stack[position]][0] == cur_max:
+            g = self.group_stack[position]
+        else:
+            g = self.next_group
+            self.next_group += 1
+            self.groups[g] = [cur_max, [], 0]
+            self.group_stack.insert(position, g)
+        heapq.heappush(self.groups[g][1], (-self.sign * c['low2'][1], c['seq']))
+        self.push_level(g)
+
+    def retrace(self, cur_high, cur_low):
+        # One candle of find_retracements(), returns the candidates retracing on it
+        retraced = []
+        merged = None
+        while self.group_stack and self.groups[self.group_stack[-1]][0] < cur_high:
+            g = self.group_stack.pop()
+            members = self.groups[g][1]
+            while members and self.fib_level(cur_high, self.exceeded[members[0][1]]) >= cur_low:
+                retraced.append(self.exceeded.pop(heapq.heappop(members)[1]))
+            if merged is None:
+                merged = g
+                continue
+            # Merge the smaller heap into the larger one
+            if len(members) > len(self.groups[merged][1]):
+                merged, g = g, merged
+            for member in self.groups.pop(g)[1]:
+                heapq.heappush(self.groups[merged][1], member)
+        if merged is not None:
+            self.groups[merged][0] = cur_high
+            self.group_stack.append(merged)
+            self.push_level(merged)
+
+        while self.levels and -self.levels[0][0] >= cur_low:
+            _, g, version = heapq.heappop(self.levels)
+            group = self.groups.get(g)
+            if group is None or version != group[2]:
+                continue
+            retraced.append(self.exceeded.pop(heapq.heappop(group[1])[1]))
+            self.push_level(g)
+        while self.group_stack and not self.groups[self.group_stack[-1]][1]:
+            del self.groups[self.group_stack.pop()]
+
+        return retraced
+
+    def highest_since(self, start):
+        # Highest high (first one on ties) from row 'start' up to the last pushed candle, None if there is none
+        position = bisect_left(self.high_index, start, lo=self.high_head)
+        return self.high_points[position] if position < len(self.high_index) else None
+
+    def resolve(self, c, status, high2, retracement):
+        c['status'] = status
+        wave = [c['seq'], c['low1'], c['high1'], c['low2'], high2, retracement, c['s1_entry']]
+        (self.success if status == 'success' else self.failure).append(wave)
+        return wave_event(status, wave)
+
+    def trim(self):
+        # Drop highs older than every open candidate, and heap entries of resolved candidates
+        while self.alive and self.alive[0]['status'] is not None:
+            self.alive.popleft()
+        # Later local minima are inside or after the current run of equal lows
+        oldest = self.plateau[0][0]
+        if self.alive:
+            oldest = min(oldest, self.alive[0]['start'])
+        self.high_head = bisect_left(self.high_index, oldest, lo=self.high_head)
+        if self.high_head > 1024 and self.high_head * 2 > len(self.high_index):
+            del self.high_index[:self.high_head]
+            del self.high_points[:self.high_head]
+            self.high_head = 0
+        if len(self.falls_below) + len(self.exceeds) > 4 * len(self.open) + 1024:
+            self.falls_below = [(-c['low1'][1], seq) for seq, c in self.open.items()]
+            self.exceeds = [(c['high1'][1], seq) for seq, c in self.open.items()]
+            heapq.heapify(self.falls_below)
+            heapq.heapify(self.exceeds)
+        if len(self.levels) > 2 * len(self.groups) + 1024:
+            self.levels = []
+            for g in self.groups:
+                self.push_level(g)
+
+    def finish(self):
+        # End of the feed, the way run() treats the end of a file:
+        #   waves still waiting for their retracement end on the last candle (retracement point = its low),
+        #   and waves that retraced on the last candle take its high into high2, as the last candle is not checked there.
+        # The events already emitted for the latter are not changed, waves() has the final values.
+        # Returns the events of the waves ended here.
+        events = []
+        if self.last_candle is None:
+            return events
+        i, _, high, low, date = self.last_candle
+        for wave in self.last_retraced:
+            wave[4] = higher_point(wave[4], (i, high, date))
+        self.last_retraced = []
+        for seq in sorted(self.exceeded):
+            c = self.exceeded[seq]
+            events.append(self.resolve(c, 'success', self.highest_since(c['breakout']), (i, low, date)))
+        self.exceeded = {}
+        self.groups, self.group_stack, self.levels = {}, [], []
+        return events
+
+    def waves(self):
+        # (success waves, failure waves) as WAVE_DTYPE arrays in candidate order, like search_high2()
+        return waves_to_array(self.success), waves_to_array(self.failure)
+
+def wave_event(status, wave):
+    # Event of a resolved wave, with the columns of build_result_df() so a list of events reads as a result DataFrame
+    _, low1, high1, low2, high2, retracement, s1_entry = wave
+    return {
+        'status': status,
+        'key': f"{low1[0]}, {low1[1]};{low2[0]}, {low2[1]}",
+        'wave': [[point[0], point[1]] for point in wave[1:6]],
+        'dates(low1; high1; low2; high2; threshold_hit)': '; '.join(str(point[2]) for point in wave[1:6]),
+        'low1': low1[1],
+        'high1': high1[1],
+        'low2': low2[1],
+        'high2': high2[1],
+        'threshold': retracement[1],
+        'wave3_max - wave1_max': high2[1] - high1[1],
+        's1_entry': s1_entry,
+        's1_profit': retracement[1] - s1_entry,
+        's1_loss': low1[1] - s1_entry,
+    }
+
+def waves_to_array(waves):
+    waves = sorted(waves, key=lambda wave: wave[0])
+    array = np.empty(len(waves), dtype=WAVE_DTYPE)
+    for p, point in enumerate(WAVE_POINTS):
+        array[f"{point}_index"] = [wave[p + 1][0] for wave in waves]
+        array[f"{point}_price"] = [wave[p + 1][1] for wave in waves]
+    return array
+
+def replay(df, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000):
+    # Push a historical file (or loaded DataFrame) through a WaveDetector, candle by candle.
+    # Returns (success_waves, failure_waves), the same as detect() / run() on that file.
+    if isinstance(df, str):
+        df = load_file(df)
+    df = convert_UNIX_to_datetime(df.copy(deep=False))
+    detector = WaveDetector(retracement_ratio, high2_retracement_ratio, reset_threshold)
+    for open, high, low, date in zip(
+        df['open'].to_numpy(dtype=float).tolist(),
+        df['high'].to_numpy(dtype=float).tolist(),
+        df['low'].to_numpy(dtype=float).tolist(),
+        df['date'].tolist(),
+    ):
+        detector.push_values(open, high, low, date)
+    detector.finish()
+
+    return detector.waves()
+
+def iter_chunks(filename, chunksize):
+    # The CSV in DataFrames of 'chunksize' rows, converted by convert_UNIX_to_datetime().
+    # Chunks cannot be sorted against each other, so the file has to be in time order already.
+    last = None
+    for chunk in pd.read_csv(filename, chunksize=chunksize):
+        time_column = next(column for column in ('unix', 'time', 'date') if column in chunk.columns)
+        times = chunk[time_column]
+        if not times.is_monotonic_increasing or (last is not None and times.iloc[0] < last):
+            raise ValueError(f"{filename} is not sorted by '{time_column}', chunked runs need the candles in time order")
+        last = times.iloc[-1]
+        yield convert_UNIX_to_datetime(chunk)
+
+def waves_result_df(detector):
+    # build_result_df() of a finished WaveDetector's waves, from the dates and entries recorded with every wave
+    records = sorted(detector.success, key=lambda wave: wave[0]) + sorted(detector.failure, key=lambda wave: wave[0])
+    dates = [date_strings([wave[p + 1][2] for wave in records]).tolist() for p in range(len(WAVE_POINTS))]
+    s1_entry = np.array([wave[6] for wave in records], dtype=float)
+    return build_result_df(None, np.concatenate(detector.waves()), dates, s1_entry)
+
+def detect_chunked(filename, chunksize=1_000_000, retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000, profiler=None):
+    # Out-of-core detect(): the CSV is read 'chunksize' rows at a time and pushed through one WaveDetector,
+    # which carries the local lows stack, the run of equal lows at the chunk boundary and the open candidates
+    # from one chunk to the next. Memory is one chunk plus that state, whatever the size of the file.
+    # Returns (success_waves, failure_waves, result_df), the same as detect() and build_result_df() on the sorted file.
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    detector = WaveDetector(retracement_ratio, high2_retracement_ratio, reset_threshold)
+    with profiler.stage('detect_chunks', chunksize=chunksize) as stage:
+        chunks = 0
+        for chunk in iter_chunks(filename, chunksize):
+            for open, high, low, date in zip(
+                chunk['open'].to_numpy(dtype=float).tolist(),
+                chunk['high'].to_numpy(dtype=float).tolist(),
+                chunk['low'].to_numpy(dtype=float).tolist(),
+                chunk['date'].tolist(),
+            ):
+                detector.push_values(open, high, low, date)
+            chunks += 1
+        detector.finish()
+        stage['rows'], stage['chunks'] = detector.rows, chunks
+    success_waves, failure_waves = detector.waves()
+    with profiler.stage('build_result_df', waves=len(success_waves) + len(failure_waves)):
+        result_df = waves_result_df(detector)
+
+    return success_waves, failure_waves, result_df
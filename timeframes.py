@@ -0,0 +1,112 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import cache
+from elliott_wave_theory import convert_UNIX_to_datetime, detect, load_file, save_outputs
+from profiling import Profiler
+
+# Higher timeframe views (e.g. 4h, 1d, 1w) of one OHLC history, detected without preparing separate CSVs.
+#
+#   waves = run_timeframes('btc_historical.csv', ['4h', '1d', '1w'], cache_folder='.ohlc_cache')
+#   success_waves, failure_waves = waves['1d']
+#
+# The base file is loaded and converted once. Every timeframe is aggregated from the previous one when its width
+# is a multiple of it (1h -> 4h -> 1d -> 1w), so only the first timeframe reads every base candle.
+# Candles are binned from Monday 1970-01-05 00:00, so weekly candles start on Mondays and daily ones at midnight.
+# With 'cache_folder', each timeframe is cached next to the source's cached frame, with its local minima and local lows.
+
+ORIGIN = np.datetime64('1970-01-05T00:00:00', 'ns')
+TIMEFRAME_UNITS = {'m': 'min', 'min': 'min', 'h': 'h', 'd': 'D', 'w': 'W'}
+
+def timeframe_width(timeframe):
+    # Width of a fixed timeframe written like the exchanges do: '15m' (or '15min'), '4h', '1d', '1w'
+    # Months ('1M') have no fixed width and are refused rather than read as minutes.
+    match = re.fullmatch(r'(\d+)\s*([a-zA-Z]+)', timeframe.strip())
+    unit = match.group(2) if match is not None else None
+    if unit != 'M' and unit is not None:
+        unit = unit.lower()
+    if unit not in TIMEFRAME_UNITS or int(match.group(1)) == 0:
+        raise ValueError(f"Unknown timeframe {timeframe!r}, use a number of minutes (m), hours (h), days (d) or weeks (w)")
+    return pd.Timedelta(int(match.group(1)), unit=TIMEFRAME_UNITS[unit])
+
+def resample_ohlc(df, timeframe):
+    # OHLC candles of 'timeframe' from a date sorted frame (see convert_UNIX_to_datetime), one pass with reduceat:
+    # first open, highest high, lowest low, last close, summed numeric columns (volumes) and the first value of the others.
+    # Each candle is dated by the start of its bin, bins without any base candle are left out.
+    width = timeframe_width(timeframe).to_timedelta64().astype('timedelta64[ns]').astype(np.int64)
+    dates = df['date'].to_numpy().astype('datetime64[ns]')
+    bins = (dates - ORIGIN).astype(np.int64) // width
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]]) if len(bins) else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(bins)] - 1
+
+    columns = {'date': ORIGIN + (bins[starts] * width).astype('timedelta64[ns]')}
+    for column in df.columns:
+        if column == 'date':
+            continue
+        values = df[column].to_numpy()
+        if column == 'open':
+            columns[column] = values[starts]
+        elif column == 'high':
+            columns[column] = np.fmax.reduceat(values.astype(float), starts) if len(starts) else values[:0]
+        elif column == 'low':
+            columns[column] = np.fmin.reduceat(values.astype(float), starts) if len(starts) else values[:0]
+        elif column == 'close':
+            columns[column] = values[ends]
+        elif values.dtype.kind in 'iuf':
+            columns[column] = np.add.reduceat(np.nan_to_num(values), starts) if len(starts) else values[:0]
+        else:
+            columns[column] = values[starts]
+
+    return pd.DataFrame(columns)
+
+def resample_cascade(df, timeframes):
+    # {timeframe: frame} for all 'timeframes', from the narrowest to the widest.
+    # A timeframe is aggregated from the widest finished one that divides it, the base frame otherwise.
+    frames = {}
+    for timeframe in sorted(timeframes, key=timeframe_width):
+        width = timeframe_width(timeframe)
+        divisors = [done for done in frames if width % timeframe_width(done) == pd.Timedelta(0)]
+        source = frames[max(divisors, key=timeframe_width)] if divisors else df
+        frames[timeframe] = resample_ohlc(source, timeframe)
+    return {timeframe: frames[timeframe] for timeframe in timeframes}
+
+def timeframe_cache_path(filename, cache_folder, timeframe):
+    # e.g. '.ohlc_cache/btc_historical_3f2a.../timeframe_4h'
+    return os.path.join(cache.cache_path(filename, cache_folder), f"timeframe_{timeframe}")
+
+def load_timeframes(filename, timeframes, cache_folder=None, df=None):
+    # {timeframe: frame} of 'filename' (or of 'df' when it is given), read from the cache when every timeframe is there
+    if cache_folder is not None:
+        paths = {timeframe: timeframe_cache_path(filename, cache_folder, timeframe) for timeframe in timeframes}
+        if all(cache.has_frame(path) for path in paths.values()):
+            return {timeframe: cache.open_frame(path) for timeframe, path in paths.items()}
+    if df is None:
+        df = load_file(filename, cache_folder)
+    frames = resample_cascade(convert_UNIX_to_datetime(df.copy(deep=False)), timeframes)
+    if cache_folder is not None:
+        for timeframe, frame in frames.items():
+            cache.save_frame(frame, paths[timeframe])
+        frames = {timeframe: cache.open_frame(path) for timeframe, path in paths.items()}
+    return frames
+
+def run_timeframes(filename, timeframes=('4h', '1d', '1w'), retracement_ratio=0.618, high2_retracement_ratio=0.382, reset_threshold=100000,
+                   folder='hypothesis_test', outputs=('result', 'processed', 'chart'), cache_folder=None, profile=False):
+    # run() on every timeframe of 'filename', outputs are named {base_name}_{timeframe}_result.csv and so on.
+    # With 'profile', one report with the stages of every timeframe is written to {folder}/{base_name}_timeframes_profile.json
+    # Returns {timeframe: (success_waves, failure_waves)}
+    base_name = filename.split(".")[0]
+    profiler = Profiler(f"{base_name}_timeframes", enabled=profile)
+    with profiler.stage('load_timeframes', timeframes=len(timeframes)):
+        frames = load_timeframes(filename, timeframes, cache_folder)
+    waves = {}
+    for timeframe, frame in frames.items():
+        with profiler.stage(f"timeframe_{timeframe}", rows=len(frame)):
+            path = timeframe_cache_path(filename, cache_folder, timeframe) if cache_folder is not None else None
+            df, local_lows, local_highs, success_waves, failure_waves = detect(frame, retracement_ratio, high2_retracement_ratio, reset_threshold, path, profiler)
+            save_outputs(f"{base_name}_{timeframe}.csv", folder, df, local_lows, local_highs, success_waves, failure_waves, outputs, profiler)
+        waves[timeframe] = (success_waves, failure_waves)
+    if profile:
+        profiler.save(f"{folder}/{base_name}_timeframes_profile.json")
+
+    return waves